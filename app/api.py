@@ -0,0 +1,198 @@
+import concurrent.futures
+import json
+import numbers
+import os
+import queue
+
+import flask
+
+from . import german_credit
+from .batching import MicroBatcher
+from .segments import traffic_stats
+
+api = flask.Blueprint("api", __name__, url_prefix="/api/v1")
+
+# Largest number of records accepted in one request
+MAX_BATCH_SIZE = 10000
+
+# Coalesces concurrent single-record requests into batched model calls.
+# Disabled unless MICRO_BATCH_WAIT_MS (the batching window) is above 0
+batcher = MicroBatcher(
+    max_batch_size=int(os.environ.get("MICRO_BATCH_SIZE", 64)),
+    max_wait=float(os.environ.get("MICRO_BATCH_WAIT_MS", 0)) / 1000,
+    max_queue_depth=int(os.environ.get("MICRO_BATCH_QUEUE_DEPTH", 1024)),
+)
+
+# Longest time (seconds) a request waits for its batch to be scored
+BATCH_TIMEOUT = float(os.environ.get("MICRO_BATCH_TIMEOUT_MS", 1000)) / 1000
+
+# Predictive features holding numbers; all others hold category codes (strings)
+numerical_predictive_features = {
+    "credit_amount",
+    "duration_months",
+    "installment_rate",
+    "number_existing_credits",
+    "number_people_liable",
+    "present_residence_since",
+}
+
+
+def validate_record(record) -> list:
+    """
+    A function to check that a record can be scored: it must be a JSON object
+    holding the 18 predictive features, numbers for numerical features and
+    strings for categorical ones, among the categories known to the active model
+    (the vocabularies of its compiled kernel, when it has one). Other fields are
+    ignored.
+
+    Args:
+        record: parsed JSON record.
+
+    Returns:
+        (list): error messages (empty if the record is valid).
+    """
+
+    if not isinstance(record, dict):
+        return ["record must be a JSON object"]
+
+    errors = []
+
+    model = german_credit.active_model
+    kernel = model.kernel if model is not None else None
+    vocabularies = dict(zip(kernel.features, kernel.lookups)) if kernel else {}
+
+    for name in german_credit.predictive_features:
+        if name not in record:
+            errors.append("missing feature: {}".format(name))
+            continue
+
+        value = record[name]
+        if name in numerical_predictive_features:
+            if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                errors.append("{} must be a number".format(name))
+        elif not isinstance(value, str):
+            errors.append("{} must be a string".format(name))
+        elif name in vocabularies and value not in vocabularies[name]:
+            errors.append("{} has unknown category: {}".format(name, value))
+
+    return errors
+
+
+def parse_records(request: flask.Request) -> tuple:
+    """
+    A function to read the records to be scored from a request body: a JSON
+    object (single record), a JSON array of objects, or JSON lines (one object
+    per line, with an application/x-ndjson or application/jsonlines content type).
+
+    Args:
+        request (flask.Request): the request.
+
+    Raises:
+        ValueError: if the body is not valid JSON.
+
+    Returns:
+        (tuple): list of records, and whether a single record was sent.
+    """
+
+    body = request.get_data(as_text=True)
+
+    if request.mimetype in ("application/x-ndjson", "application/jsonlines"):
+        return [json.loads(line) for line in body.splitlines() if line.strip()], False
+
+    payload = json.loads(body)
+
+    if isinstance(payload, list):
+        return payload, False
+
+    return [payload], True
+
+
+def record_traffic(records: list, probabilities, labels) -> None:
+    # Per-segment statistics of the served predictions (see segments.py)
+    traffic_stats.update_batch(
+        [record.get("gender") for record in records],
+        [record.get("age_over_forty") for record in records],
+        probabilities,
+        labels,
+    )
+
+
+def error_response(status: int, errors: list) -> flask.Response:
+    response = flask.jsonify({"errors": errors})
+    response.status_code = status
+    return response
+
+
+@api.route("/score", methods=["POST"])
+def score():
+    """
+    A route to score one or many records with a single model call.
+
+    Returns JSON with probability_of_default and predicted_score: values for a
+    single record, lists (in input order) for a batch. Invalid input gets a 400
+    response listing the errors of each invalid record.
+    """
+
+    try:
+        records, single = parse_records(flask.request)
+    except ValueError as error:
+        return error_response(400, ["invalid JSON: {}".format(error)])
+
+    if len(records) > MAX_BATCH_SIZE:
+        return error_response(
+            413, ["at most {} records per request".format(MAX_BATCH_SIZE)]
+        )
+
+    errors = [
+        {"record": i, "errors": record_errors}
+        for i, record_errors in enumerate(map(validate_record, records))
+        if record_errors
+    ]
+    if errors:
+        return error_response(400, errors)
+
+    if single and batcher.max_wait > 0:
+        try:
+            scored = batcher.score(records[0], timeout=BATCH_TIMEOUT)
+        except queue.Full:
+            return error_response(503, ["scoring queue is full, retry later"])
+        except concurrent.futures.TimeoutError:
+            return error_response(503, ["scoring timed out, retry later"])
+
+        record_traffic(
+            records, [scored["probability_of_default"]], [scored["predicted_score"]]
+        )
+
+        return flask.jsonify(
+            {
+                "probability_of_default": scored["probability_of_default"],
+                "predicted_score": scored["predicted_score"],
+            }
+        )
+
+    probabilities, labels = german_credit.score_batch(records)
+    record_traffic(records, probabilities, labels)
+
+    if single:
+        return flask.jsonify(
+            {
+                "probability_of_default": probabilities[0].item(),
+                "predicted_score": labels[0],
+            }
+        )
+
+    return flask.jsonify(
+        {
+            "probability_of_default": probabilities.tolist(),
+            "predicted_score": labels.tolist(),
+        }
+    )
+
+
+@api.route("/score/batching", methods=["GET"])
+def batching_stats():
+    """
+    A route to get the micro-batching metrics: batch sizes and queue wait.
+    """
+
+    return flask.jsonify(dict(batcher.stats(), enabled=batcher.max_wait > 0))
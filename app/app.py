@@ -1,8 +1,16 @@
-import pandas as pd
-import json
+import atexit
+import contextlib
+import datetime
+import os
+import threading
+import time
+import urllib.parse
+
+# Startup report: time spent importing modules, measured from here
+import_start = time.perf_counter()
 
 # For downloading data
-import urllib
+import flask
 
 import visdcc
 
@@ -11,17 +19,102 @@ from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output, State
 
 # model
-from .german_credit import init, score
+from .api import api
+from . import german_credit
+from .german_credit import (
+    explain,
+    init,
+    predictive_features,
+    score,
+    score_cache,
+    validate_fast_predict_proba,
+)
+from .data_loader import read_json_lines
+from .drift import create_drift_monitor
+from .events import event_log
+from .explorer import PopulationExplorer
+from .feedback import create_feedback_writer
+from .metrics import registry
+from .export import (
+    iter_csv,
+    iter_scored_csv,
+    parse_ids,
+    parse_json_ids,
+    summary_frame,
+)
+from .reference import build_reference_data, precompute_scores
+from .registry import create_model_registry
+from .segments import histogram_edges, reference_segment_stats, traffic_stats
+from .whatif import MAX_SWEPT_FEATURES, feature_vocabularies, sweep, sweep_values
+
+imports_seconds = time.perf_counter() - import_start
+
+# Model and reference data files (app/data in the Docker image)
+DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
+
+# Read-only reference data store and population explorer, built by create_app
+reference_data = None
+population_explorer = None
 
-# Load pre-trained model
-init()
+# Per-segment statistics of the reference predictions, built with the scores
+reference_segments = None
+
+# Versioned model artifacts with hot reload, if MODEL_REGISTRY_DIR is set
+model_registry = None
+
+# Duration (seconds) of each startup phase, filled in by create_app
+startup_times = {}
+startup_lock = threading.Lock()
+# Set by create_app once every startup phase has succeeded
+initialized = False
+# Marks the requests create_app sends to warm up Dash
+WARMUP_ENVIRON_KEY = "app.warmup"
+
+# Feedback on predictions, appended to a JSON lines file by a background thread
+feedback_writer = create_feedback_writer()
+atexit.register(feedback_writer.flush, 5)
+
+# Latency of the Dash callbacks, exported with the other metrics on /metrics
+callback_duration = registry.histogram(
+    "dash_callback_duration_seconds",
+    "Time spent in each Dash callback.",
+    ("callback",),
+)
+callback_stage_duration = registry.histogram(
+    "dash_callback_stage_duration_seconds",
+    "Time spent in each stage of a Dash callback: lookup, scoring, matching and "
+    "serialization.",
+    ("callback", "stage"),
+)
 
-# Reading local files
-training_data = pd.read_json(
-    "/app/data/training_data.json", lines=True, orient="records"
+registry.counter(
+    "score_cache_hits_total",
+    "Predictions served from score_cache.",
+    lambda: score_cache.hits,
+)
+registry.counter(
+    "score_cache_misses_total",
+    "Predictions not found in score_cache.",
+    lambda: score_cache.misses,
+)
+registry.counter(
+    "score_cache_evictions_total",
+    "Predictions evicted from score_cache to stay within its size.",
+    lambda: score_cache.evictions,
+)
+registry.gauge(
+    "score_cache_size", "Predictions held in score_cache.", lambda: len(score_cache)
+)
+registry.gauge(
+    "app_startup_seconds",
+    "Time spent starting the app: imports, model, data and layout.",
+    lambda: sum(startup_times.values()),
+)
+registry.counter(
+    "feedback_dropped_total",
+    "Feedback entries dropped because the queue was full.",
+    lambda: feedback_writer.dropped,
 )
-testing_data = pd.read_json("/app/data/testing_data.json", lines=True, orient="records")
-input_data = pd.concat([training_data, testing_data])
 
 # Setting custom css stylesheet
 external_stylesheets = ["assets/custom_template.css"]
@@ -35,6 +128,9 @@ app = dash.Dash(
 
 
 server = app.server
+
+# REST/JSON scoring API (/api/v1/score)
+server.register_blueprint(api)
 app.config.suppress_callback_exceptions = True
 
 # Odd row highlighting and conditional coloring for tables
@@ -148,11 +244,51 @@ categorical_features = [
     "age_over_forty",
 ]
 
+# Columns of the closest records table
+matches_columns = features + ["status", "probability_of_default"]
+
+# Numbers of closest records offered, and their restrictions (see match_candidates)
+matches_k_options = (5, 10, 20, 50)
+matches_filter_options = ("training", "same_outcome")
+
 # Map between raw and legible feature names
 feature_name_map = {raw_feature_names[i]: features[i] for i in range(0, len(features))}
 
 feature_name_map_reverse = {k: v for v, k in feature_name_map.items()}
 
+# Columns of the population explorer (reference data + precomputed scores);
+# numeric ones are filtered and sorted as numbers
+explorer_columns = features + ["status", "probability_of_default", "predicted_score"]
+numeric_explorer_columns = {"ID", "probability_of_default"} | {
+    feature_name_map[name] for name in numerical_features
+}
+
+explorer_column_names = {
+    "status": "Status",
+    "probability_of_default": "Probability of Default",
+    "predicted_score": "Prediction",
+}
+
+# Number of features shown in the explanation of a prediction
+explanation_drivers = 5
+
+# Columns of the segment analytics table
+segment_columns = {
+    "dimension": "Dimension",
+    "segment": "Segment",
+    "records": "Records",
+    "predicted_default_rate": "Predicted Default Rate",
+    "observed_default_rate": "Observed Default Rate",
+    "mean_probability_of_default": "Mean Probability of Default",
+    "approval_rate": "Approval Rate",
+    "approval_rate_ratio": "Approval Rate Ratio",
+}
+
+# Features that can be varied in the what-if analysis
+whatif_options = [
+    {"label": feature_name_map[name], "value": name} for name in predictive_features
+]
+
 # A message to be displayed when scoring is not applicable
 not_applicable_message = html.P(
     children=[
@@ -167,7 +303,7 @@ not_applicable_message = html.P(
 app.title = "A Dash Demo Model using German Credit Data"
 
 # Layout of Dash app
-app.layout = html.Div(
+layout = html.Div(
     [
         # Header
         html.H3(
@@ -262,13 +398,52 @@ app.layout = html.Div(
                         ),
                         html.Div(
                             [  # Collapsible content
-                                # A table showing (up tp) closest 5 matches
+                                html.Div(
+                                    [  # Number of matches and restrictions
+                                        html.Span("Matches:\u00A0"),
+                                        dcc.Dropdown(
+                                            id="matches_k",
+                                            options=[
+                                                {"label": str(k), "value": k}
+                                                for k in matches_k_options
+                                            ],
+                                            value=5,
+                                            clearable=False,
+                                            style={"width": 80},
+                                        ),
+                                        dcc.Checklist(
+                                            id="matches_filters",
+                                            options=[
+                                                {
+                                                    "label": "Training records only",
+                                                    "value": "training",
+                                                },
+                                                {
+                                                    "label": "Same outcome only",
+                                                    "value": "same_outcome",
+                                                },
+                                            ],
+                                            value=[],
+                                            inline=True,
+                                            style={"margin-left": 15},
+                                        ),
+                                    ],
+                                    className="NoSpaceBetween",
+                                    style={"margin-bottom": 10},
+                                ),
+                                # A table showing (up tp) the k closest matches
                                 dash_table.DataTable(
                                     id="matches_table",
                                     columns=[
                                         {"name": feat, "id": feat} for feat in features
                                     ]
-                                    + [{"name": "Status", "id": "status"}],
+                                    + [
+                                        {"name": "Status", "id": "status"},
+                                        {
+                                            "name": "Probability of Default",
+                                            "id": "probability_of_default",
+                                        },
+                                    ],
                                     data=[],
                                     style_table={"minWidth": "100%"},
                                     style_header={
@@ -288,6 +463,165 @@ app.layout = html.Div(
                     ],
                     open=True,
                 ),  # Details div will be open by default
+                # Browsing all reference records, one page at a time
+                html.Details(
+                    [
+                        html.Summary(
+                            "Population Explorer",
+                            style={"margin-top": 10, "margin-bottom": 10},
+                        ),
+                        dash_table.DataTable(
+                            id="population_table",
+                            columns=[
+                                {
+                                    "name": explorer_column_names.get(column, column),
+                                    "id": column,
+                                    "type": (
+                                        "numeric"
+                                        if column in numeric_explorer_columns
+                                        else "text"
+                                    ),
+                                }
+                                for column in explorer_columns
+                            ],
+                            data=[],
+                            # Filtering, sorting and paging run server-side
+                            page_action="custom",
+                            page_current=0,
+                            page_size=15,
+                            filter_action="custom",
+                            filter_query="",
+                            sort_action="custom",
+                            sort_mode="multi",
+                            sort_by=[],
+                            style_table={"minWidth": "100%", "overflowX": "auto"},
+                            style_header={
+                                "backgroundColor": "#03331E",
+                                "fontSize": 12,
+                                "color": "white",
+                            },
+                            style_cell=table_cell_style,
+                            style_data_conditional=var_color_options,
+                            style_as_list_view=True,
+                        ),
+                        html.P(id="population_count", style={"fontSize": 12}),
+                    ]
+                ),
+                # Model behaviour across gender and age groups
+                html.Details(
+                    [
+                        html.Summary(
+                            "Segment Analytics",
+                            style={"margin-top": 10, "margin-bottom": 10},
+                        ),
+                        html.Div(
+                            [
+                                dcc.RadioItems(
+                                    id="segments_source",
+                                    options=[
+                                        {
+                                            "label": "Reference Set",
+                                            "value": "reference",
+                                        },
+                                        {"label": "Scored Traffic", "value": "traffic"},
+                                    ],
+                                    value="reference",
+                                    inline=True,
+                                    style={"display": "inline-block"},
+                                ),
+                                html.Button(
+                                    "Refresh",
+                                    id="segments_refresh",
+                                    style={"margin-left": 10},
+                                ),
+                            ],
+                            style={"margin-bottom": 10},
+                        ),
+                        dash_table.DataTable(
+                            id="segments_table",
+                            columns=[
+                                {"name": name, "id": column}
+                                for column, name in segment_columns.items()
+                            ],
+                            data=[],
+                            style_table={"minWidth": "100%", "overflowX": "auto"},
+                            style_header={
+                                "backgroundColor": "#03331E",
+                                "fontSize": 12,
+                                "color": "white",
+                            },
+                            style_cell=table_cell_style,
+                            style_data_conditional=var_color_options,
+                            style_as_list_view=True,
+                        ),
+                        dcc.Graph(id="segments_histogram"),
+                    ]
+                ),
+                # Distributions of the scored records against the training data
+                html.Details(
+                    [
+                        html.Summary(
+                            "Data Drift",
+                            style={"margin-top": 10, "margin-bottom": 10},
+                        ),
+                        html.Div(
+                            [
+                                html.Button("Refresh", id="drift_refresh"),
+                                html.Span(
+                                    id="drift_count",
+                                    style={"margin-left": 10, "fontSize": 12},
+                                ),
+                            ],
+                            style={"margin-bottom": 10},
+                        ),
+                        dash_table.DataTable(
+                            id="drift_table",
+                            columns=[
+                                {"name": "Feature", "id": "feature"},
+                                {"name": "PSI", "id": "psi"},
+                                {"name": "KL Divergence", "id": "kl_divergence"},
+                                {"name": "Drift", "id": "level"},
+                            ],
+                            data=[],
+                            style_header={
+                                "backgroundColor": "#03331E",
+                                "fontSize": 12,
+                                "color": "white",
+                            },
+                            style_cell=table_cell_style,
+                            style_data_conditional=[
+                                {
+                                    "if": {"filter_query": '{level} = "moderate"'},
+                                    "backgroundColor": "#F9B341",
+                                },
+                                {
+                                    "if": {"filter_query": '{level} = "significant"'},
+                                    "backgroundColor": "#FE6666",
+                                },
+                            ],
+                            style_as_list_view=True,
+                        ),
+                    ]
+                ),
+                # Probability of default of the record, as one or two features vary
+                html.Details(
+                    [
+                        html.Summary(
+                            "What-If Analysis",
+                            style={"margin-top": 10, "margin-bottom": 10},
+                        ),
+                        dcc.Dropdown(
+                            id="whatif_features",
+                            options=whatif_options,
+                            value=["credit_amount"],
+                            multi=True,
+                            placeholder="Features to vary (at most {})".format(
+                                MAX_SWEPT_FEATURES
+                            ),
+                        ),
+                        dcc.Graph(id="whatif_graph"),
+                    ]
+                ),
             ],
             className="Tables",
         ),
@@ -299,7 +633,9 @@ app.layout = html.Div(
                         html.Div(
                             id="messages",
                             children=not_applicable_message,
-                        )
+                        ),
+                        # Features that drove the prediction
+                        html.Div(id="explanation", style={"fontSize": 12}),
                     ],
                     style={"margin-right": 15, "width": "30%"},
                 ),
@@ -343,7 +679,11 @@ app.layout = html.Div(
                                     "Submit Feedback",
                                     id="submit_feedback",
                                     style={"margin": 0},
-                                )
+                                ),
+                                html.Span(
+                                    id="feedback_status",
+                                    style={"margin-left": 10, "fontSize": 12},
+                                ),
                             ]
                         ),
                     ],
@@ -352,15 +692,6 @@ app.layout = html.Div(
             ],
             className="feedbackArea",
         ),
-        # divs to store model outputs
-        html.Div(id="prediction", style={"display": "none"}),
-        html.Div(id="probability_of_default", style={"display": "none"}),
-        html.Div(id="recordIDs", style={"display": "none"}),
-        html.Div(
-            id="input_record",
-            style={"display": "none"},
-            children="[loading]",
-        ),
         # scroll to top
         html.Div(
             [html.Button("Top", id="TopButton"), visdcc.Run_js(id="javascript")],
@@ -371,6 +702,168 @@ app.layout = html.Div(
 )
 
 
+def serve_layout():
+    """
+    A function to serve the layout. The last scored record is kept in the browser
+    (scored_record), so that feedback does not depend on the worker that served
+    the scoring.
+
+    :return: the layout
+    """
+
+    return html.Div(
+        [
+            dcc.Store(id="scored_record"),
+            layout,
+        ]
+    )
+
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    """
+    A context manager recording the duration of a startup phase in startup_times.
+
+    :param name: name of the phase
+    """
+
+    start = time.perf_counter()
+    yield
+    startup_times[name] = time.perf_counter() - start
+
+
+def load_reference_scores(model=None) -> None:
+    """
+    A function to score the reference data with the active model (precomputed
+    predictions) and to build the population explorer on the scored data. Run at
+    startup, then whenever the model registry activates another model.
+
+    :param model: the activated model (unused: scoring uses the active model)
+    """
+
+    global reference_data, population_explorer, reference_segments
+
+    # Score every reference record once, so that update_table answers from
+    # precomputed predictions. Disable with PRECOMPUTE_SCORES=0
+    data = reference_data._replace(
+        probabilities=None, predictions=None, contributions=None
+    )
+    if os.environ.get("PRECOMPUTE_SCORES", "1") != "0":
+        data = precompute_scores(data)
+
+    # Population explorer: server-side filtering, sorting and paging
+    explorer_data = data.data.rename(columns=feature_name_map)[features + ["status"]]
+    if data.probabilities is not None:
+        explorer_data = explorer_data.assign(
+            probability_of_default=data.probabilities,
+            predicted_score=data.predictions,
+        )
+
+    population_explorer = PopulationExplorer(explorer_data)
+    reference_segments = reference_segment_stats(data)
+    reference_data = data
+
+
+def create_app() -> dash.Dash:
+    """
+    An app factory: loads the model and the reference data, then sets the layout
+    and lets Dash build its index page, layout and callback map. Callbacks and
+    routes are registered on import, but need this to have run. Later calls
+    return the same app; after a failed startup, the next call starts over.
+
+    The duration of each phase (imports, model, data, layout) is logged as a
+    startup event, kept in startup_times and exported on /metrics.
+
+    :return: the Dash app
+    """
+
+    global reference_data, model_registry, initialized
+
+    with startup_lock:
+        if initialized:
+            return app
+
+        startup_times.clear()
+        startup_times["imports"] = imports_seconds
+
+        with startup_phase("data"):
+            # Reading local files, concatenated once into a memory-mapped binary
+            # cache whose pages all workers share
+            data = read_json_lines(
+                [
+                    os.path.join(DATA_DIR, "training_data.json"),
+                    os.path.join(DATA_DIR, "testing_data.json"),
+                ]
+            )
+
+            # Baseline distributions of the predictive features, against which
+            # the records scored from now on are compared
+            training_data = data.iloc[: data.attrs["sources"]["training_data.json"]]
+            german_credit.drift_monitor = create_drift_monitor(
+                training_data, predictive_features
+            )
+
+            # Read-only reference data store (encoded arrays, id mapping, matching
+            # engine), shared by all request handlers and never modified after
+            # this point. Closest records are found with SIMILARITY_METRIC over
+            # the predictive features (gower by default, "exact" for equal values
+            # over all columns); MATCHING_MODE=inverted switches exact matching
+            # to posting lists for very large reference sets
+            metric = os.environ.get("SIMILARITY_METRIC", "gower")
+            reference_data = build_reference_data(
+                data,
+                mode=os.environ.get("MATCHING_MODE", "dense"),
+                metric=None if metric == "exact" else metric,
+            )
+
+        with startup_phase("model"):
+            model_registry = create_model_registry(reference_data.data)
+
+            if model_registry is None:
+                # Load pre-trained model (or its saved compiled kernel), and check
+                # the compiled kernel against sklearn on the whole reference set
+                # (once per model artifact)
+                init(os.path.join(DATA_DIR, "logreg_classifier.pickle"))
+                validate_fast_predict_proba(reference_data.data)
+            else:
+                # Activate the selected version once validated, and follow the
+                # versions activated later
+                model_registry.refresh()
+                model_registry.listeners.append(load_reference_scores)
+
+            load_reference_scores()
+
+        with startup_phase("layout"):
+            app.layout = serve_layout
+
+            # Let Dash build its index page, layout and callback map now rather
+            # than on the first request (of each worker, under gunicorn)
+            client = server.test_client()
+            for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+                client.get(path, environ_overrides={WARMUP_ENVIRON_KEY: True})
+
+        event_log.emit(
+            "startup",
+            seconds=dict(startup_times),
+            total_seconds=sum(startup_times.values()),
+        )
+
+        initialized = True
+
+    return app
+
+
+def initialize_on_first_request():
+    # Servers started on app.app:server rather than app.wsgi:create_server()
+    # start the app up on their first request
+    if not initialized and not flask.request.environ.get(WARMUP_ENVIRON_KEY):
+        create_app()
+
+
+# Before Dash's own first-request setup, which needs the layout
+server.before_request_funcs.setdefault(None, []).insert(0, initialize_on_first_request)
+
+
 @app.callback(Output("javascript", "run"), [Input("TopButton", "n_clicks")])
 def myfun(x):
     if x:
@@ -379,71 +872,73 @@ def myfun(x):
 
 
 @app.callback(
-    [
-        Output("input_record", "children"),
-        Output("input_record_visual", "data"),
-    ],
+    Output("input_record_visual", "data"),
     [Input("id", "value")],
 )
+@callback_duration.timed("update_id")
 def update_id(id):
     """
 
     :param id: record id
-    :return: a record of input_feature_A + attributes (actual + visual)
+    :return: a record of input_feature_A + attributes (visual)
     """
 
-    try:
-        record_info = input_data[input_data["id"] == id]
-    except:
-        record_info = pd.DataFrame()
+    with callback_stage_duration.time("update_id", "lookup"):
+        record_info = reference_data.record(id)
 
-    record_info_visual = record_info.rename(columns=feature_name_map)
+    with callback_stage_duration.time("update_id", "serialization"):
+        # Only the displayed columns are sent to the browser
+        record_info_visual = record_info.rename(columns=feature_name_map)[
+            features
+        ].to_dict(orient="records")
 
-    print(record_info_visual.to_dict(orient="records"))
-    return (
-        json.dumps(record_info.to_dict(orient="records")),
-        record_info_visual.to_dict(orient="records"),
-    )
+    if event_log.sampled():
+        event_log.emit("update_id", id=id, records=record_info_visual)
+
+    return record_info_visual
 
 
 @app.callback(
     [
         Output("matches_table", "data"),
-        Output("recordIDs", "children"),
         Output("messages", "children"),
-        Output("prediction", "children"),
-        Output("probability_of_default", "children"),
+        Output("explanation", "children"),
+        Output("scored_record", "data"),
     ],
     [Input("scoring_button", "n_clicks")],
     [
-        State("input_record", "children"),
         State("id", "value"),
+        State("matches_k", "value"),
+        State("matches_filters", "value"),
     ],
 )
-def update_table(n_clicks, input_record, id):
+@callback_duration.timed("update_table")
+def update_table(n_clicks, id, k, filters):
     """
-    A Function to send record to model and parse output
+    A Function to send record to model and parse output.
 
     :param n_clicks:
-    :param input_record:
     :param id:
-    :return:
+    :param k: number of closest records
+    :param filters: restrictions of the closest records ("training", "same_outcome")
+    :return: closest records, prediction message, explanation and the scored
+        record's id (for feedback)
     """
 
-    if input_record == "[loading]":  # empty record on loading
+    position = reference_data.lookup(id)
+
+    if not n_clicks:  # nothing scored yet on loading
 
         return (
-            [],
             [],
             not_applicable_message,
-            0.0,
-            0.0,
+            "",
+            None,
         )
 
-    elif input_record == "[]":  # Empty record corresponding to invalid id input
+    elif position is None:  # invalid id input
 
         return (
-            [],
             [],
             html.P(
                 children=[
@@ -454,29 +949,28 @@ def update_table(n_clicks, input_record, id):
                     html.P("\u00A0"),
                 ]
             ),
-            0.0,
-            0.0,
+            "",
+            None,
         )
 
     else:
-        json_record = json.loads(input_record)[0]
-        output = score(json_record)
-        prediction = output["predicted_score"]
+        with callback_stage_duration.time("update_table", "scoring"):
+            probability_of_default, prediction = predict_reference_record(position)
+            contributions = explain_reference_record(position)
 
         if prediction == "Default":
             background_color = "red"
         else:
             background_color = "green"
 
-        probability_of_default = output["probability_of_default"]
-
-        row = input_data[input_data["id"] == id].reset_index(drop=True)
-        input_data["matches"] = input_data.apply(
-            lambda idx: sum(sum(idx.values == row.values)), axis=1
-        )
-        input_data.sort_values(by=["matches"], inplace=True, ascending=False)
-        # Top 5 matches not including self
-        matches = input_data.iloc[1:6].rename(columns=feature_name_map)
+        with callback_stage_duration.time("update_table", "matching"):
+            # Top k matches not including self, displayed columns only
+            matches = closest_records(position, k, filters).rename(
+                columns=feature_name_map
+            )
+            matches = matches[
+                [column for column in matches_columns if column in matches]
+            ]
 
         text_output = html.P(
             children=[
@@ -496,76 +990,601 @@ def update_table(n_clicks, input_record, id):
             ]
         )
 
-        print(matches.to_dict(orient="records"))
+        with callback_stage_duration.time("update_table", "serialization"):
+            matches_records = matches.to_dict(orient="records")
+
+        if event_log.sampled():
+            event_log.emit(
+                "update_table",
+                id=id,
+                prediction=prediction,
+                probability_of_default=probability_of_default,
+                matches=matches_records,
+            )
 
         return (
-            matches.to_dict(orient="records"),
-            matches.ID.values,
+            matches_records,
             text_output,
-            prediction,
-            probability_of_default,
+            explanation_output(position, contributions),
+            {"id": id},
         )
 
 
 @app.callback(
-    [Output("download_data_link", "href"), Output("download_data_link", "download")],
+    Output("feedback_status", "children"),
+    [Input("submit_feedback", "n_clicks")],
     [
-        Input("input_record_visual", "data"),
-        Input("matches_table", "data"),
-        Input("id", "value"),
-        Input("prediction", "children"),
-        Input("probability_of_default", "children"),
+        State("prediction_rating", "value"),
+        State("feedback", "value"),
+        State("scored_record", "data"),
     ],
 )
-def update_download_data_link(
-    input_record,
-    matches_table,
-    id,
-    prediction,
-    probability_of_default,
-):
-    """
-    A function to read generated data and download a corresponding CSV file
-
-    :param input_record:
-    :param matches_table:
-    :param id:
-    :param prediction:
-    :param probability_of_default:
-    :return: a link to download data in a CSV format
+@callback_duration.timed("submit_feedback")
+def submit_feedback(n_clicks, rating, feedback, scored_record):
     """
+    A function to record feedback on the last scored record of the session, whose
+    id update_table keeps in the browser (any worker can serve it). Only the id
+    comes from the browser: the prediction is looked up again here, with the
+    version of the model that made it.
+    The entry is only queued here; feedback_writer appends it to disk.
 
-    record_string = pd.DataFrame.from_records(input_record).to_csv(
-        index=False, encoding="utf-8"
+    :param n_clicks:
+    :param rating: rating of the prediction, 1 to 5
+    :param feedback: feedback text
+    :param scored_record: id of the last scored record
+    :return: a status message
+    """
+
+    if not n_clicks:
+        return ""
+
+    id = scored_record.get("id") if isinstance(scored_record, dict) else None
+    position = reference_data.lookup(id)
+
+    if position is None:
+        return "Score a record before submitting feedback."
+
+    model = german_credit.active_model
+    probability_of_default, prediction = predict_reference_record(position)
+
+    queued = feedback_writer.submit(
+        {
+            "id": id,
+            "model_version": model.version if model else None,
+            "prediction": prediction,
+            "probability_of_default": probability_of_default,
+            "rating": rating,
+            "feedback": feedback or "",
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
     )
 
-    table_string = pd.DataFrame.from_records(matches_table).to_csv(
-        index=False, encoding="utf-8"
+    if not queued:
+        return "Feedback could not be recorded, please retry later."
+
+    return "Thank you for your feedback!"
+
+
+@app.callback(
+    [
+        Output("population_table", "data"),
+        Output("population_table", "page_count"),
+        Output("population_count", "children"),
+    ],
+    [
+        Input("population_table", "page_current"),
+        Input("population_table", "page_size"),
+        Input("population_table", "sort_by"),
+        Input("population_table", "filter_query"),
+    ],
+)
+@callback_duration.timed("update_population_table")
+def update_population_table(page_current, page_size, sort_by, filter_query):
+    """
+    A function to serve one page of the population explorer, filtered and sorted
+    server-side.
+
+    :param page_current: page number, from 0
+    :param page_size: rows per page
+    :param sort_by: columns to sort by
+    :param filter_query: filter expression from the table's filter row
+    :return: rows of the page, number of pages, number of matching records
+    """
+
+    try:
+        rows, page_count, n_records = population_explorer.page(
+            page_current, page_size, sort_by, filter_query
+        )
+    except ValueError as error:
+        return [], 1, str(error)
+
+    return (
+        rows,
+        page_count,
+        "{} of {} records".format(n_records, len(population_explorer.data)),
     )
 
-    summary_string = pd.DataFrame(
+
+@app.callback(
+    [
+        Output("segments_table", "data"),
+        Output("segments_histogram", "figure"),
+    ],
+    [
+        Input("segments_source", "value"),
+        Input("segments_refresh", "n_clicks"),
+    ],
+)
+@callback_duration.timed("update_segments")
+def update_segments(source, n_clicks):
+    """
+    A function to display the per-segment statistics of the reference set or of
+    the traffic scored by this worker, and the distribution of the probability of
+    default in each gender and age group.
+
+    :param source: "reference" or "traffic"
+    :param n_clicks: refreshes the statistics (e.g. of the traffic scored since)
+    :return: rows of the segments table, histogram figure
+    """
+
+    stats = reference_segments if source == "reference" else traffic_stats
+    rows = stats.summary() if stats is not None else []
+
+    # One bar per gender and age group in each bin
+    bins = histogram_edges()
+    groups = [row for row in rows if row["dimension"] == "gender_age_over_forty"]
+    figure = {
+        "data": [
+            {
+                "type": "bar",
+                "name": row["segment"],
+                "x": [edge + bins[1] / 2 for edge in bins],
+                "y": [count / row["records"] for count in row["histogram"]],
+            }
+            for row in groups
+        ],
+        "layout": {
+            "barmode": "group",
+            "xaxis": {"title": "Probability of Default (gender/age over forty)"},
+            "yaxis": {"title": "Share of Records"},
+            "height": 300,
+            "margin": {"t": 20},
+        },
+    }
+
+    return (
         [
             {
-                "ID": id,
-                "Logistic Regression Prediction": prediction,
-                "Probability of Default": probability_of_default,
+                column: round(value, 3) if isinstance(value, float) else value
+                for column, value in row.items()
+                if column in segment_columns
             }
+            for row in rows
+        ],
+        figure,
+    )
+
+
+@app.callback(
+    [Output("drift_table", "data"), Output("drift_count", "children")],
+    [Input("drift_refresh", "n_clicks")],
+)
+@callback_duration.timed("update_drift")
+def update_drift(n_clicks):
+    """
+    A function to display the drift of each predictive feature in the records
+    scored by this worker, from its distribution in the training data.
+
+    :param n_clicks: refreshes the report
+    :return: rows of the drift table, number of records observed
+    """
+
+    if german_credit.drift_monitor is None:
+        return [], "Drift monitoring is disabled."
+
+    report = german_credit.drift_monitor.report()
+
+    rows = [
+        {
+            "feature": feature_name_map[name],
+            "psi": None if drift["psi"] is None else round(drift["psi"], 4),
+            "kl_divergence": (
+                None
+                if drift["kl_divergence"] is None
+                else round(drift["kl_divergence"], 4)
+            ),
+            "level": drift["level"],
+        }
+        for name, drift in report["features"].items()
+    ]
+
+    return rows, "{} records scored since startup".format(report["records"])
+
+
+@app.callback(
+    Output("whatif_graph", "figure"),
+    [Input("id", "value"), Input("whatif_features", "value")],
+)
+@callback_duration.timed("update_whatif")
+def update_whatif(id, swept_features):
+    """
+    A function to plot the probability of default of a record as one feature
+    (curve) or two features (heatmap) take every value known to the model, the
+    others keeping the record's values. The grid is scored in one batched call.
+
+    :param id: record id
+    :param swept_features: features to vary (the first MAX_SWEPT_FEATURES are used)
+    :return: the figure
+    """
+
+    position = reference_data.lookup(id)
+    swept_features = (swept_features or [])[:MAX_SWEPT_FEATURES]
+
+    if position is None or not swept_features:
+        return {"data": [], "layout": {"height": 350}}
+
+    record = reference_data.data.iloc[position].to_dict()
+    vocabularies = feature_vocabularies(reference_data.vocabularies)
+
+    with callback_stage_duration.time("update_whatif", "scoring"):
+        grid = {
+            name: sweep_values(vocabularies[name], name in numerical_features)
+            for name in swept_features
+        }
+        probabilities = sweep(record, grid)
+
+    values = [grid[name].tolist() for name in swept_features]
+    titles = [feature_name_map[name] for name in swept_features]
+
+    if len(swept_features) == 1:
+        numeric = swept_features[0] in numerical_features
+        data = [
+            {
+                "type": "scatter" if numeric else "bar",
+                "x": values[0],
+                "y": probabilities.tolist(),
+                "name": "Probability of Default",
+            },
+            {
+                "type": "scatter",
+                "mode": "markers",
+                "x": [record[swept_features[0]]],
+                "y": [predict_reference_record(position)[0]],
+                "name": "Record",
+                "marker": {"size": 10, "color": "red"},
+            },
+        ]
+        layout = {
+            "xaxis": {"title": titles[0], "type": "linear" if numeric else "category"},
+            "yaxis": {"title": "Probability of Default"},
+        }
+    else:
+        data = [
+            {
+                "type": "heatmap",
+                "x": values[0],
+                "y": values[1],
+                "z": probabilities.T.tolist(),
+                "colorbar": {"title": "Probability of Default"},
+            },
+            {
+                "type": "scatter",
+                "mode": "markers",
+                "x": [record[swept_features[0]]],
+                "y": [record[swept_features[1]]],
+                "name": "Record",
+                "marker": {"size": 10, "color": "red"},
+            },
+        ]
+        layout = {
+            "xaxis": {"title": titles[0]},
+            "yaxis": {"title": titles[1]},
+        }
+
+    layout.update(height=350, margin={"t": 20}, showlegend=False)
+
+    return {"data": data, "layout": layout}
+
+
+@app.callback(
+    [Output("download_data_link", "href"), Output("download_data_link", "download")],
+    [
+        Input("id", "value"),
+        Input("matches_k", "value"),
+        Input("matches_filters", "value"),
+    ],
+)
+@callback_duration.timed("update_download_data_link")
+def update_download_data_link(id, k, filters):
+    """
+    A function to point the download link to the CSV export of a record, with the
+    closest records chosen in the Closest Records section.
+    The CSV itself is only generated when the link is clicked (see export_record).
+
+    :param id: record id
+    :param k: number of closest records
+    :param filters: restrictions of the closest records
+    :return: a link to download data in a CSV format, and the file name
+    """
+
+    if reference_data.lookup(id) is None:
+        return ("", "")
+
+    query = [("id", id), ("k", k or matches_k_options[0])]
+    query += [("filter", name) for name in filters or []]
+
+    return (
+        app.get_relative_path("/export/record.csv?" + urllib.parse.urlencode(query)),
+        "model_results_appID_{}.csv".format(id),
+    )
+
+
+def predict_reference_record(position: int) -> tuple:
+    """
+    A function to get the prediction for a reference record: precomputed if
+    available, scored otherwise.
+
+    :param position: position of the record in the reference data
+    :return: probability of default and predicted score
+    """
+
+    precomputed = reference_data.scored(position)
+
+    if precomputed is not None:
+        return precomputed
+
+    record = reference_data.data.iloc[[position]].to_dict(orient="records")[0]
+    output = score(record, reference_id=record["id"])
+
+    return output["probability_of_default"], output["predicted_score"]
+
+
+def match_candidates(position: int, filters: list):
+    """
+    A function to restrict the closest records of a reference record.
+
+    :param position: position of the record in the reference data
+    :param filters: "training" for training records only, "same_outcome" for
+        records with the same status as the record
+    :return: boolean mask of the records that may be returned, or None for all
+    """
+
+    candidates = None
+
+    if filters and "training" in filters:
+        candidates = reference_data.sources == "training_data.json"
+
+    if filters and "same_outcome" in filters:
+        status = reference_data.data["status"].to_numpy()
+        same = status == status[position]
+        candidates = same if candidates is None else candidates & same
+
+    return candidates
+
+
+def closest_records(position: int, k: int, filters: list):
+    """
+    A function to get the closest records of a reference record, as displayed in
+    the Closest Records section and exported with the record.
+
+    :param position: position of the record in the reference data
+    :param k: number of closest records (defaults to the first option)
+    :param filters: restrictions of the closest records (see match_candidates)
+    :return: the closest records (pandas.DataFrame), closest first
+    """
+
+    return reference_data.closest(
+        position,
+        k=k or matches_k_options[0],
+        candidates=match_candidates(position, filters),
+    )
+
+
+def explain_reference_record(position: int) -> dict:
+    """
+    A function to get the explanation of the prediction for a reference record:
+    precomputed if available, computed from the record otherwise.
+
+    :param position: position of the record in the reference data
+    :return: predictive feature -> contribution to the log-odds of default, or
+        None if the model cannot be explained
+    """
+
+    precomputed = reference_data.explanation(position)
+
+    if precomputed is not None:
+        return dict(zip(predictive_features, precomputed.tolist()))
+
+    return explain(reference_data.data.iloc[position].to_dict())
+
+
+def explanation_output(position: int, contributions: dict):
+    """
+    A function to render the features with the largest contributions to a
+    prediction, largest first.
+
+    :param position: position of the record in the reference data
+    :param contributions: feature -> contribution, from explain_reference_record
+    :return: the explanation panel
+    """
+
+    if contributions is None:
+        return html.P("Explanations are not available for this model.")
+
+    drivers = sorted(contributions.items(), key=lambda item: -abs(item[1]))
+    record = reference_data.data.iloc[position]
+
+    return html.Div(
+        [
+            html.Strong("Top Drivers (log-odds of default):"),
+            html.Ul(
+                [
+                    html.Li(
+                        [
+                            "{} = {}: ".format(feature_name_map[name], record[name]),
+                            html.Span(
+                                "{:+.3f}".format(contribution),
+                                style={"color": "red" if contribution > 0 else "green"},
+                            ),
+                        ]
+                    )
+                    for name, contribution in drivers[:explanation_drivers]
+                ]
+            ),
         ]
-    ).to_csv(index=False, encoding="utf-8")
-
-    csv_string = (
-        "data:text/csv;charset=utf-8,"
-        + urllib.parse.quote(record_string)
-        + "\n"
-        + urllib.parse.quote(table_string)
-        + "\n"
-        + urllib.parse.quote(summary_string)
     )
 
-    csv_filename = "model_results_appID_{}.csv".format(id)
 
-    return (csv_string, csv_filename)
+def csv_response(chunks, filename: str) -> flask.Response:
+    """
+    A function to stream CSV text to the client, with chunked transfer encoding.
+
+    :param chunks: generator of CSV text
+    :param filename: name of the downloaded file
+    :return: a streamed response
+    """
+
+    return flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="{}"'.format(filename)},
+    )
+
+
+@server.route("/metrics")
+def metrics():
+    """
+    A route to get the latency histograms and counters of this worker process, in
+    the Prometheus text format.
+    """
+
+    return flask.Response(
+        registry.expose(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@server.before_request
+def start_model_registry_polling():
+    # Each worker process watches the registry directory for new versions. Not
+    # the warm-up requests of create_app: with preload_app, they run in the
+    # gunicorn master, whose thread would be forked holding the registry lock
+    if initialized and model_registry is not None:
+        model_registry.start_polling()
+
+
+@server.route("/models")
+def models():
+    """
+    A route to get the model registry status: available versions, active and
+    shadow versions, shadow comparison counters and validation reports.
+    """
+
+    if model_registry is None:
+        active = german_credit.active_model
+        return flask.jsonify(
+            {"active": active.version if active else None, "registry": False}
+        )
+
+    return flask.jsonify(dict(model_registry.status(), registry=True))
+
+
+@server.route("/segments")
+def segments():
+    """
+    A route to get the per-segment statistics of the predictions (gender, age over
+    forty, and both): over the reference set, and over the records scored by the
+    API in this worker process.
+    """
+
+    return flask.jsonify(
+        {
+            "histogram_bins": histogram_edges(),
+            "reference": (
+                reference_segments.summary() if reference_segments is not None else None
+            ),
+            "traffic": traffic_stats.summary(),
+        }
+    )
+
+
+@server.route("/drift")
+def drift():
+    """
+    A route to get the input drift report of this worker process: per predictive
+    feature, PSI and KL divergence of the scored records from the training data,
+    with the baseline and observed histograms.
+    """
+
+    if german_credit.drift_monitor is None:
+        return flask.jsonify({"enabled": False})
+
+    return flask.jsonify(dict(german_credit.drift_monitor.report(), enabled=True))
+
+
+@server.route("/export/record.csv")
+def export_record():
+    """
+    A route to download a record, its closest matches and its prediction as CSV.
+
+    Query string: id (record id), k (number of closest records, as in the
+    Closest Records section) and filter (restriction of the closest records,
+    repeated: "training", "same_outcome")
+    """
+
+    id = flask.request.args.get("id", type=int)
+    position = reference_data.lookup(id)
+
+    if position is None:
+        flask.abort(404, description="Unknown record id")
+
+    k = flask.request.args.get("k", matches_k_options[0], type=int)
+    filters = flask.request.args.getlist("filter")
+
+    if k not in matches_k_options:
+        flask.abort(400, description="k must be one of {}".format(matches_k_options))
+    if not set(filters) <= set(matches_filter_options):
+        flask.abort(
+            400, description="filter must be in {}".format(matches_filter_options)
+        )
+
+    probability_of_default, prediction = predict_reference_record(position)
+
+    frames = [
+        reference_data.data.iloc[[position]].rename(columns=feature_name_map),
+        closest_records(position, k, filters).rename(columns=feature_name_map),
+        summary_frame(id, prediction, probability_of_default),
+    ]
+
+    return csv_response(iter_csv(frames), "model_results_appID_{}.csv".format(id))
+
+
+@server.route("/export/scores.csv", methods=["GET", "POST"])
+def export_scores():
+    """
+    A route to download scored reference records as CSV, streamed in chunks.
+
+    Records are selected by id, either in the query string (?ids=1,2,3) or, for
+    long lists, in a JSON body ({"ids": [1, 2, 3]}). Without ids, the whole
+    reference set is exported.
+    """
+
+    try:
+        ids = parse_ids(flask.request.args.getlist("ids"))
+        if flask.request.is_json:
+            ids += parse_json_ids(flask.request.get_json())
+    except ValueError:
+        flask.abort(400, description="Record ids must be integers")
+
+    positions = None
+
+    if ids:
+        positions = [reference_data.lookup(id) for id in ids]
+        unknown = [id for id, position in zip(ids, positions) if position is None]
+        if unknown:
+            flask.abort(404, description="Unknown record ids: {}".format(unknown))
+
+    return csv_response(iter_scored_csv(reference_data, positions), "scores.csv")
 
 
 if __name__ == "__main__":
-    app.run_server(debug=True, host="0.0.0.0", port=8080, use_reloader=False)
+    create_app().run_server(debug=True, host="0.0.0.0", port=8080, use_reloader=False)
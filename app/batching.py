@@ -0,0 +1,201 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+
+from . import german_credit
+from .workers import BackgroundWorker
+
+
+class MicroBatcher(BackgroundWorker):
+    """
+    A request coalescer in front of the model.
+
+    Records submitted from any thread (or asyncio task) are queued; a background
+    thread groups those arriving within max_wait seconds of the first one, up to
+    max_batch_size records, and scores them with a single score_batch call. Each
+    caller gets its own result through a future.
+
+    Args:
+        max_batch_size (int): largest number of records per model call.
+        max_wait (float): longest time (seconds) a record waits for others to join
+            its batch.
+        max_queue_depth (int): largest number of queued records. Beyond it, submit
+            raises queue.Full, so that callers can shed load (backpressure).
+        score_batch: batch scoring function, german_credit.score_batch by default.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+        max_queue_depth: int = 1024,
+        score_batch=None,
+    ):
+        super().__init__(max_queue_depth)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.score_batch = score_batch or german_credit.score_batch
+
+        self._lock = threading.Lock()
+
+        # Batch sizes are counted in power-of-two buckets: 1, 2, 4, ...
+        self._size_buckets = [0] * (max_batch_size.bit_length() + 1)
+        self.batches = 0
+        self.records = 0
+        self.rejected = 0
+        self.wait_seconds_sum = 0.0
+        self.wait_seconds_max = 0.0
+
+    def submit(self, record: dict) -> concurrent.futures.Future:
+        """
+        Queue a record for scoring.
+
+        Args:
+            record (dict): record to be scored, containing predictive features.
+
+        Raises:
+            queue.Full: if max_queue_depth records are already waiting.
+
+        Returns:
+            (concurrent.futures.Future): resolves to the scored record (a dict, as
+                returned by german_credit.score).
+        """
+
+        future = concurrent.futures.Future()
+
+        try:
+            self._ensure_started().put_nowait((record, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+
+        return future
+
+    def score(self, record: dict, timeout: float = None) -> dict:
+        """
+        Score a record, blocking until its batch has been scored (threaded servers).
+
+        Args:
+            record (dict): record to be scored, containing predictive features.
+            timeout (float): seconds to wait for the result (no limit if None).
+
+        Raises:
+            queue.Full: if max_queue_depth records are already waiting.
+            concurrent.futures.TimeoutError: if the record is not scored within
+                timeout seconds. It is then left out of its batch, unless that
+                is already being scored.
+
+        Returns:
+            (dict): Scored (predicted) input data.
+        """
+
+        future = self.submit(record)
+
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def score_async(self, record: dict) -> dict:
+        """
+        Score a record without blocking the event loop (asyncio servers).
+
+        Args:
+            record (dict): record to be scored, containing predictive features.
+
+        Returns:
+            (dict): Scored (predicted) input data.
+        """
+
+        return await asyncio.wrap_future(self.submit(record))
+
+    def _run(self, pending: queue.Queue) -> None:
+        while True:
+            batch = [pending.get()]
+            deadline = batch[0][2] + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(
+                        pending.get(timeout=remaining)
+                        if remaining > 0
+                        else pending.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+
+            # Records whose caller gave up waiting are left out
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if batch:
+                self._record_batch(batch)
+                self._score(batch)
+
+    def _score(self, batch: list) -> None:
+        records = [record for record, _, _ in batch]
+
+        try:
+            probabilities, labels = self.score_batch(records)
+        except Exception:
+            # Score records one by one, so that a bad record only fails its caller
+            for record, future, _ in batch:
+                try:
+                    probabilities, labels = self.score_batch([record])
+                except Exception as error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(_scored(record, probabilities[0], labels[0]))
+            return
+
+        for (record, future, _), probability, label in zip(
+            batch, probabilities, labels
+        ):
+            future.set_result(_scored(record, probability, label))
+
+    def _record_batch(self, batch: list) -> None:
+        now = time.perf_counter()
+        waits = [now - submitted for _, _, submitted in batch]
+
+        with self._lock:
+            self.batches += 1
+            self.records += len(batch)
+            self._size_buckets[(len(batch) - 1).bit_length()] += 1
+            self.wait_seconds_sum += sum(waits)
+            self.wait_seconds_max = max(self.wait_seconds_max, max(waits))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            (dict): number of batches and records, mean batch size, batch size
+                histogram (records per batch, up to the bucket bound -> batches),
+                queue wait (mean and max, in ms), rejected records and current
+                queue depth.
+        """
+
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "records": self.records,
+                "mean_batch_size": self.records / self.batches if self.batches else 0.0,
+                "batch_size_histogram": {
+                    str(min(1 << i, self.max_batch_size)): count
+                    for i, count in enumerate(self._size_buckets)
+                    if (1 << i) < 2 * self.max_batch_size
+                },
+                "mean_queue_wait_ms": (
+                    1000 * self.wait_seconds_sum / self.records if self.records else 0.0
+                ),
+                "max_queue_wait_ms": 1000 * self.wait_seconds_max,
+                "rejected": self.rejected,
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            }
+
+
+def _scored(record: dict, probability, label) -> dict:
+    return dict(
+        record, probability_of_default=probability.item(), predicted_score=label
+    )
@@ -0,0 +1,278 @@
+"""
+Offline bulk scoring of JSON-lines application dumps (the format of
+training_data.json), without the web app.
+
+The input is read in chunks of lines, chunks are parsed and scored in a pool of
+worker processes (german_credit.score_batch, one model call per chunk) and the
+results are written in input order, as JSON lines (each record with
+probability_of_default and predicted_score added) or CSV. At most a few chunks
+per worker are in memory at any time.
+
+Usage, from the repository root:
+
+    python -m app.bulk_score applications.json scored.json
+    python -m app.bulk_score applications.json scored.csv --format csv --workers 4
+    cat applications.json | python -m app.bulk_score - - > scored.json
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+from . import german_credit
+
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.dirname(__file__), "data", "logreg_classifier.pickle"
+)
+
+# Columns added to each record
+OUTPUT_COLUMNS = ["probability_of_default", "predicted_score"]
+
+
+def iter_chunks(lines, chunk_size: int):
+    """
+    A generator of chunks of non-empty lines.
+
+    Args:
+        lines: iterable of lines (e.g. a file).
+        chunk_size (int): number of lines per chunk.
+
+    Yields:
+        (tuple): number of the first line of the chunk (from 1), list of lines.
+    """
+
+    numbered = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk[0][0], [line for _, line in chunk]
+
+
+def init_worker(model_path: str) -> None:
+    # Each worker process loads the model once
+    german_credit.init(model_path)
+
+
+def score_chunk(first_line: int, lines: list, output_format: str, fieldnames=None):
+    """
+    A function to parse, score and serialize a chunk of JSON lines.
+
+    Args:
+        first_line (int): line number of the first line, for error messages.
+        lines (list): JSON lines, one record each.
+        output_format (str): "jsonl" or "csv".
+        fieldnames (list): CSV columns (csv format only).
+
+    Raises:
+        ValueError: naming the first line that cannot be parsed or scored.
+
+    Returns:
+        (tuple): serialized output text and number of records.
+    """
+
+    try:
+        # One parser call per chunk rather than per line
+        records = json.loads("[" + ",".join(lines) + "]")
+    except ValueError:
+        records = None
+
+    if records is None or len(records) != len(lines):
+        records = []
+        for number, line in enumerate(lines, first_line):
+            try:
+                records.append(json.loads(line))
+            except ValueError as error:
+                raise ValueError("line {}: invalid JSON ({})".format(number, error))
+
+    try:
+        probabilities, labels = german_credit.score_batch(records)
+    except Exception:
+        # Find the offending record
+        for number, record in enumerate(records, first_line):
+            try:
+                german_credit.score_batch([record])
+            except Exception as error:
+                raise ValueError("line {}: {!r}".format(number, error))
+        raise
+
+    if output_format == "csv":
+        output = io.StringIO()
+        writer = csv.DictWriter(
+            output, fieldnames, restval="", extrasaction="ignore", lineterminator="\n"
+        )
+        for record, probability, label in zip(records, probabilities, labels):
+            record["probability_of_default"] = probability.item()
+            record["predicted_score"] = label
+            writer.writerow(record)
+        return output.getvalue(), len(records)
+
+    return (
+        "".join(
+            json.dumps(
+                dict(
+                    record,
+                    probability_of_default=probability.item(),
+                    predicted_score=label,
+                )
+            )
+            + "\n"
+            for record, probability, label in zip(records, probabilities, labels)
+        ),
+        len(records),
+    )
+
+
+def bulk_score(
+    source,
+    target,
+    model_path: str = DEFAULT_MODEL_PATH,
+    output_format: str = "jsonl",
+    chunk_size: int = 10000,
+    workers: int = None,
+    progress=None,
+) -> int:
+    """
+    A function to score a JSON-lines stream into an output stream, in order.
+
+    Args:
+        source: input text stream, one JSON record per line.
+        target: output text stream.
+        model_path (str): location of the pickled model artifact.
+        output_format (str): "jsonl" or "csv".
+        chunk_size (int): number of records per chunk (and per model call).
+        workers (int): number of worker processes. Defaults to the number of
+            CPUs; 0 or 1 scores in this process.
+        progress: callable receiving (records scored, seconds elapsed) after each
+            chunk.
+
+    Returns:
+        (int): number of records scored.
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    chunks = iter_chunks(source, chunk_size)
+    start = time.perf_counter()
+    total = 0
+
+    # CSV columns: those of the first record, then the scores
+    fieldnames = None
+    if output_format == "csv":
+        first = next(chunks, None)
+        if first is None:
+            return 0
+        fieldnames = [
+            name for name in json.loads(first[1][0]) if name not in OUTPUT_COLUMNS
+        ] + OUTPUT_COLUMNS
+        csv.writer(target, lineterminator="\n").writerow(fieldnames)
+        chunks = itertools.chain([first], chunks)
+
+    def write(output: str, records: int) -> None:
+        nonlocal total
+        target.write(output)
+        total += records
+        if progress is not None:
+            progress(total, time.perf_counter() - start)
+
+    if workers <= 1:
+        init_worker(model_path)
+        for first_line, lines in chunks:
+            write(*score_chunk(first_line, lines, output_format, fieldnames))
+        return total
+
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=init_worker, initargs=(model_path,)
+    ) as pool:
+        # Bounded window of chunks in flight, written back in submission order
+        pending = collections.deque()
+
+        for first_line, lines in chunks:
+            pending.append(
+                pool.submit(score_chunk, first_line, lines, output_format, fieldnames)
+            )
+            if len(pending) >= 2 * workers:
+                write(*pending.popleft().result())
+
+        while pending:
+            write(*pending.popleft().result())
+
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("input", help="JSON-lines file, or - for stdin")
+    parser.add_argument("output", help="output file, or - for stdout")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="model artifact")
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000, help="records per chunk"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="worker processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="no progress report on stderr"
+    )
+    args = parser.parse_args()
+
+    last_report = [0.0]
+
+    def progress(records: int, seconds: float) -> None:
+        # At most one line per second
+        if seconds - last_report[0] >= 1.0:
+            last_report[0] = seconds
+            print(
+                "{} records scored, {:.0f} records/sec".format(
+                    records, records / seconds
+                ),
+                file=sys.stderr,
+            )
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    target = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+
+    start = time.perf_counter()
+    try:
+        total = bulk_score(
+            source,
+            target,
+            model_path=args.model,
+            output_format=args.format,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            progress=None if args.quiet else progress,
+        )
+    except ValueError as error:
+        raise SystemExit("Scoring failed: {}".format(error))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    seconds = time.perf_counter() - start
+    if not args.quiet:
+        print(
+            "Scored {} records in {:.2f}s ({:.0f} records/sec)".format(
+                total, seconds, total / seconds if seconds else 0.0
+            ),
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy
+import pandas
+from pandas.core.internals import BlockManager
+from pandas.core.internals.api import make_block
+
+from .events import event_log
+
+# Bump when the on-disk layout changes, so that old caches are rebuilt
+CACHE_VERSION = 2
+
+
+def file_digest(path: str) -> str:
+    """
+    A function to compute the sha256 of a file, reading it in chunks.
+
+    Args:
+        path (str): file to hash.
+
+    Returns:
+        (str): hex digest.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def read_json_lines(path, cache_dir: str = None) -> pandas.DataFrame:
+    """
+    A function to read one or several JSON-lines files of records into a single
+    DataFrame, through a columnar binary cache.
+
+    On first load the files are parsed, concatenated, and every column is written
+    to its own .npy file (object columns as integer codes + categories). Loads
+    then memory-map those files instead of parsing the JSON: numerical columns
+    are the mapped arrays and text columns pandas.Categorical over the mapped
+    codes, so that workers share the pages via the OS page cache. The cache is
+    rebuilt when a source file changes: sizes and mtimes are checked first, and
+    sha256 digests when they differ.
+
+    Args:
+        path (str | list): JSON-lines file, one record per line, or list of files
+            whose records are concatenated in order.
+        cache_dir (str): directory holding the cache. Defaults to a ".cache"
+            directory next to the (first) source file.
+
+    Returns:
+        (pandas.DataFrame): the records, with text columns as categoricals.
+            attrs["sources"] maps each file name to its number of records.
+    """
+
+    paths = [path] if isinstance(path, str) else list(path)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(paths[0]), ".cache")
+    cache_dir = os.path.join(
+        cache_dir, "+".join(os.path.basename(path) for path in paths)
+    )
+
+    source = []
+    for path in paths:
+        stat = os.stat(path)
+        source.append({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+    manifest = _read_manifest(cache_dir)
+    if manifest is not None:
+        if manifest["source"] == source:
+            return _load_cache(cache_dir, manifest)
+
+        digest = _files_digest(paths)
+        if manifest["sha256"] == digest:
+            # Same contents, new mtime (e.g. a fresh copy): refresh the manifest
+            manifest["source"] = source
+            try:
+                _write_manifest(cache_dir, manifest)
+            except OSError:
+                pass
+            return _load_cache(cache_dir, manifest)
+    else:
+        digest = _files_digest(paths)
+
+    frames = [pandas.read_json(path, lines=True, orient="records") for path in paths]
+    data = pandas.concat(frames, ignore_index=True)
+    sources = [
+        [os.path.basename(path), len(frame)] for path, frame in zip(paths, frames)
+    ]
+
+    try:
+        _write_cache(cache_dir, data, source, digest, sources)
+        return _load_cache(cache_dir, _read_manifest(cache_dir))
+    except (OSError, TypeError, ValueError) as error:
+        # Read-only file system or values that cannot be cached: serve parsed data
+        event_log.emit("cache_write_failure", paths=paths, error=str(error))
+
+    for name, column in data.items():
+        if column.dtype == object:
+            data[name] = pandas.Categorical(column, categories=column.dropna().unique())
+    data.attrs["sources"] = dict(sources)
+
+    return data
+
+
+def _files_digest(paths: list) -> str:
+    if len(paths) == 1:
+        return file_digest(paths[0])
+
+    return hashlib.sha256(
+        "".join(file_digest(path) for path in paths).encode()
+    ).hexdigest()
+
+
+def _read_manifest(cache_dir: str) -> dict:
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as manifest:
+            manifest = json.load(manifest)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("version") != CACHE_VERSION:
+        return None
+
+    return manifest
+
+
+def _write_manifest(cache_dir: str, manifest: dict) -> None:
+    # Written last and atomically: a cache without a manifest is never read
+    _atomic_write(
+        os.path.join(cache_dir, "manifest.json"),
+        lambda target: target.write(json.dumps(manifest).encode()),
+    )
+
+
+def _atomic_write(path: str, write) -> None:
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, "wb") as target:
+            write(target)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _write_cache(
+    cache_dir: str, data: pandas.DataFrame, source: list, digest: str, sources: list
+):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    columns = []
+    numeric = {}
+    for position, (name, column) in enumerate(data.items()):
+        if column.dtype == object:
+            file_name = "{}.npy".format(position)
+            # Codes in the integer type pandas.Categorical uses for this number of
+            # categories, so that loading does not convert (copy) them
+            categories = column.dropna().unique()
+            values = pandas.Categorical(column, categories=categories).codes
+            _atomic_write(
+                os.path.join(cache_dir, file_name),
+                lambda target: numpy.save(target, values, allow_pickle=False),
+            )
+            # Categories go to the manifest, so they must be JSON-serializable
+            columns.append(
+                {
+                    "name": name,
+                    "file": file_name,
+                    "categories": json.loads(json.dumps(categories.tolist())),
+                }
+            )
+        else:
+            # Columns of the same type go to one 2-D file, a row each in column
+            # order: the layout of a consolidated pandas block
+            file_name = "{}.npy".format(column.dtype.name)
+            numeric.setdefault(file_name, []).append(column.to_numpy())
+            columns.append({"name": name, "file": file_name})
+
+    for file_name, rows in numeric.items():
+        _atomic_write(
+            os.path.join(cache_dir, file_name),
+            lambda target: numpy.save(target, numpy.stack(rows), allow_pickle=False),
+        )
+
+    _write_manifest(
+        cache_dir,
+        {
+            "version": CACHE_VERSION,
+            "source": source,
+            "sha256": digest,
+            "sources": sources,
+            "columns": columns,
+        },
+    )
+
+
+def _load_cache(cache_dir: str, manifest: dict) -> pandas.DataFrame:
+    # The DataFrame is assembled from blocks over the mapped arrays: built from
+    # separate columns, pandas would copy same-type columns into one block
+    # (consolidation) on the first multi-column selection
+    blocks = []
+    positions = {}
+
+    for position, column in enumerate(manifest["columns"]):
+        if "categories" in column:
+            # Over the mapped codes, which it does not copy; -1 codes are NaN
+            values = pandas.Categorical.from_codes(
+                numpy.load(os.path.join(cache_dir, column["file"]), mmap_mode="r"),
+                categories=column["categories"],
+            )
+            blocks.append(make_block(values, placement=[position], ndim=2))
+        else:
+            positions.setdefault(column["file"], []).append(position)
+
+    for file_name, placement in positions.items():
+        values = numpy.load(os.path.join(cache_dir, file_name), mmap_mode="r")
+        blocks.append(make_block(values, placement=placement))
+
+    data = pandas.DataFrame(
+        BlockManager(
+            blocks,
+            [
+                pandas.Index([column["name"] for column in manifest["columns"]]),
+                pandas.RangeIndex(sum(length for _, length in manifest["sources"])),
+            ],
+        )
+    )
+    data.attrs["sources"] = dict(manifest["sources"])
+
+    return data
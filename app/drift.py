@@ -0,0 +1,257 @@
+import bisect
+import os
+import threading
+
+import numpy
+import pandas
+
+# Number of equal-width bins of the numerical feature histograms
+DEFAULT_BINS = 10
+
+# Share given to empty bins, so that PSI and KL divergence stay finite
+EPSILON = 1e-4
+
+# Population stability index thresholds: below the first, the distribution is
+# stable; above the second, it has shifted significantly
+PSI_THRESHOLDS = (0.1, 0.25)
+
+
+class DriftMonitor:
+    """
+    Input drift monitor: the distribution of each feature in the scored records,
+    compared with its distribution in a baseline (the training data).
+
+    At construction, numerical features get fixed-width bins over their baseline
+    range (values outside fall in the outer bins) and categorical ones a bin per
+    baseline category plus one for unseen values; the baseline counts are computed
+    once. Each observed record then adds 1 to one bin per feature, in a flat list
+    of counters owned by the calling thread, so that observing takes no lock.
+    The lists of all threads are summed when a report is requested. When a
+    thread first observes, the lists of finished threads are folded into one
+    array, so that their number stays that of the live threads.
+
+    Args:
+        baseline (pandas.DataFrame): baseline records, e.g. the training data.
+        features (list): monitored columns. Numeric columns are binned, others
+            treated as categories.
+        bins (int): number of bins of the numerical features.
+    """
+
+    def __init__(
+        self, baseline: pandas.DataFrame, features: list, bins: int = DEFAULT_BINS
+    ):
+        self.features = list(features)
+
+        # Per feature: (name, offset of its first bin, inner bin edges of a
+        # numerical feature or None, category -> counter and pandas.Index of
+        # the categories of a categorical one, number of bins)
+        self._bins = []
+        self.labels = {}
+        baseline_counts = []
+        offset = 0
+
+        for name in self.features:
+            values = baseline[name]
+
+            if _is_numeric(values):
+                edges = numpy.linspace(values.min(), values.max(), bins + 1)
+                inner = edges[1:-1].tolist()
+                counts = numpy.bincount(
+                    numpy.searchsorted(inner, values.to_numpy(), side="right"),
+                    minlength=bins,
+                )
+                self._bins.append((name, offset, inner, None, None, bins))
+                self.labels[name] = [
+                    "[{:g}, {:g})".format(low, high)
+                    for low, high in zip(edges[:-1], edges[1:])
+                ]
+            else:
+                categories = sorted(values.dropna().unique().tolist(), key=str)
+                lookup = {category: offset + i for i, category in enumerate(categories)}
+                index = pandas.Index(categories)
+                positions = index.get_indexer(values)
+                positions[positions < 0] = len(categories)
+                counts = numpy.bincount(positions, minlength=len(categories) + 1)
+                self._bins.append(
+                    (name, offset, None, lookup, index, len(categories) + 1)
+                )
+                self.labels[name] = [str(category) for category in categories] + [
+                    "(unseen)"
+                ]
+
+            baseline_counts.append(counts)
+            offset += len(counts)
+
+        self.baseline_counts = numpy.concatenate(baseline_counts)
+        self.n_bins = offset
+
+        # Hot path of observe: one loop per feature type, with the bin of unseen
+        # categories precomputed
+        self._numeric_bins = [
+            (name, offset, edges)
+            for name, offset, edges, _, _, _ in self._bins
+            if edges is not None
+        ]
+        self._categorical_bins = [
+            (name, lookup, offset + n_bins - 1)
+            for name, offset, edges, lookup, _, n_bins in self._bins
+            if edges is None
+        ]
+
+        # Counters of each live thread (by thread), the calling thread's own, and
+        # the sum of those of finished threads
+        self._accumulators = {}
+        self._local = threading.local()
+        self._retired = numpy.zeros(self.n_bins, dtype=numpy.int64)
+        self._lock = threading.Lock()
+
+    def _counts(self) -> list:
+        counts = getattr(self._local, "counts", None)
+
+        if counts is None:
+            counts = self._local.counts = [0] * self.n_bins
+            with self._lock:
+                self._prune()
+                self._accumulators[threading.current_thread()] = counts
+
+        return counts
+
+    def _prune(self) -> None:
+        # Called with _lock held. A finished thread no longer updates its list
+        finished = [thread for thread in self._accumulators if not thread.is_alive()]
+        for thread in finished:
+            self._retired += self._accumulators.pop(thread)
+
+    def observe(self, record: dict) -> None:
+        """
+        Add a record to the observed distributions, without locking.
+
+        Args:
+            record (dict): scored record, containing the monitored features.
+        """
+
+        counts = self._counts()
+
+        for name, offset, edges in self._numeric_bins:
+            counts[offset + bisect.bisect_right(edges, record[name])] += 1
+
+        for name, lookup, unseen in self._categorical_bins:
+            counts[lookup.get(record[name], unseen)] += 1
+
+    def observe_batch(self, columns) -> None:
+        """
+        Add many records to the observed distributions.
+
+        Args:
+            columns: mapping of feature name -> 1-D array of values (a dict of
+                arrays, a pandas.DataFrame or a NumPy structured array).
+        """
+
+        counts = self._counts()
+
+        for name, offset, edges, _, index, n_bins in self._bins:
+            values = numpy.asarray(columns[name])
+            if edges is not None:
+                positions = numpy.searchsorted(edges, values, side="right")
+            else:
+                positions = index.get_indexer(values)
+                positions[positions < 0] = n_bins - 1
+
+            for i, count in enumerate(numpy.bincount(positions, minlength=n_bins)):
+                counts[offset + i] += int(count)
+
+    def observed_counts(self) -> numpy.ndarray:
+        """
+        Returns:
+            (numpy.ndarray): observed count of each bin, summed over all threads.
+        """
+
+        with self._lock:
+            self._prune()
+            # Copies: increments racing with the copy show up next time
+            live = [list(counts) for counts in self._accumulators.values()]
+            retired = self._retired.copy()
+
+        return (
+            numpy.array(live, dtype=numpy.int64).reshape(-1, self.n_bins).sum(axis=0)
+            + retired
+        )
+
+    def report(self) -> dict:
+        """
+        Returns:
+            (dict): number of observed records and, per feature, the population
+                stability index (PSI) and the KL divergence of the observed
+                distribution from the baseline (None before any record is
+                observed), the drift level ("stable", "moderate" or "significant"
+                by PSI) and the baseline and observed shares of each bin.
+        """
+
+        observed = self.observed_counts()
+        features = {}
+
+        for name, offset, _, _, _, n_bins in self._bins:
+            expected_counts = self.baseline_counts[offset : offset + n_bins]
+            observed_counts = observed[offset : offset + n_bins]
+
+            expected = _shares(expected_counts)
+            actual = _shares(observed_counts)
+
+            psi = kl_divergence = level = None
+            if observed_counts.sum():
+                ratio = numpy.log(actual / expected)
+                psi = float(((actual - expected) * ratio).sum())
+                kl_divergence = float((actual * ratio).sum())
+                level = (
+                    "stable"
+                    if psi < PSI_THRESHOLDS[0]
+                    else "moderate" if psi < PSI_THRESHOLDS[1] else "significant"
+                )
+
+            features[name] = {
+                "psi": psi,
+                "kl_divergence": kl_divergence,
+                "level": level,
+                "bins": self.labels[name],
+                "baseline": (expected_counts / max(expected_counts.sum(), 1)).tolist(),
+                "observed": (observed_counts / max(observed_counts.sum(), 1)).tolist(),
+            }
+
+        # Each record adds 1 to one bin of every feature
+        records = int(observed[: self._bins[0][5]].sum()) if self._bins else 0
+
+        return {"records": records, "features": features}
+
+
+def _is_numeric(values: pandas.Series) -> bool:
+    numeric = pandas.api.types.is_numeric_dtype(values)
+    return numeric and not pandas.api.types.is_bool_dtype(values)
+
+
+def _shares(counts: numpy.ndarray) -> numpy.ndarray:
+    # Share of each bin, empty bins counting as EPSILON
+    shares = counts / max(counts.sum(), 1)
+    shares = numpy.maximum(shares, EPSILON)
+    return shares / shares.sum()
+
+
+def create_drift_monitor(baseline: pandas.DataFrame, features: list) -> DriftMonitor:
+    """
+    A function to create the drift monitor configured by the environment:
+    DRIFT_MONITOR=0 disables it, DRIFT_BINS sets the number of bins of the
+    numerical features (default 10).
+
+    Args:
+        baseline (pandas.DataFrame): baseline records, e.g. the training data.
+        features (list): monitored columns.
+
+    Returns:
+        (DriftMonitor): the monitor, or None if disabled.
+    """
+
+    if os.environ.get("DRIFT_MONITOR", "1") == "0":
+        return None
+
+    return DriftMonitor(
+        baseline, features, bins=int(os.environ.get("DRIFT_BINS", DEFAULT_BINS))
+    )
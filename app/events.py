@@ -0,0 +1,93 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from .workers import BackgroundWorker
+
+
+class EventLog(BackgroundWorker):
+    """
+    A sampled, structured event log: each event is one JSON object per line.
+
+    Only a sample_rate fraction of the events is kept, so that logging can stay
+    on under load. Kept events are put on a queue and written to the handler
+    (stdout by default) by a background thread, never on the request path.
+
+    Args:
+        sample_rate (float): fraction of the events logged, from 0 (off) to 1.
+        name (str): logger name.
+        handler (logging.Handler): destination of the events.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        name: str = "app.events",
+        handler: logging.Handler = None,
+    ):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.handler = handler or logging.StreamHandler(sys.stdout)
+
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def _start(self, events: queue.Queue) -> None:
+        # The logger only queues events; a listener thread hands them to handler
+        self.logger.handlers = [logging.handlers.QueueHandler(events)]
+        listener = logging.handlers.QueueListener(events, self.handler)
+        listener.start()
+        # Write the events still queued when the process exits
+        atexit.register(listener.stop)
+
+    def sampled(self) -> bool:
+        """
+        Returns:
+            (bool): whether the next event is to be logged. Check it before
+                building expensive event fields.
+        """
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def log(self, event: str, **fields) -> None:
+        """
+        Log an event, if sampled.
+
+        Args:
+            event (str): event name.
+            **fields: JSON-serializable event fields.
+        """
+
+        if not self.sampled():
+            return
+
+        self.emit(event, **fields)
+
+    def emit(self, event: str, **fields) -> None:
+        """
+        Log an event, without sampling (the caller has called sampled).
+
+        Args:
+            event (str): event name.
+            **fields: JSON-serializable event fields.
+        """
+
+        self._ensure_started()
+
+        self.logger.info(
+            json.dumps(
+                dict(event=event, time=time.time(), pid=os.getpid(), **fields),
+                default=str,
+            )
+        )
+
+
+# Events of this process, sampled at LOG_SAMPLE_RATE (off by default)
+event_log = EventLog(sample_rate=float(os.environ.get("LOG_SAMPLE_RATE", 0)))
@@ -0,0 +1,288 @@
+import collections
+import math
+import operator
+import re
+import threading
+
+import numpy
+import pandas
+
+# One condition of a DataTable filter query: {column} operator value
+FILTER_CONDITION = re.compile(
+    r"^\{(?P<column>[^}]+)\}\s+(?P<operator>\S+)\s*(?P<value>.*)$"
+)
+
+# DataTable filter operators (symbols and words, without the s/i prefix)
+FILTER_OPERATORS = {
+    "=": "eq",
+    "eq": "eq",
+    "!=": "ne",
+    "ne": "ne",
+    "<": "lt",
+    "lt": "lt",
+    "<=": "le",
+    "le": "le",
+    ">": "gt",
+    "gt": "gt",
+    ">=": "ge",
+    "ge": "ge",
+    "contains": "contains",
+    "datestartswith": "datestartswith",
+}
+
+# Comparison of each operator: Python operators rather than ufuncs, which have no
+# loop for the str arrays of case-insensitive comparisons (numpy.equal & co.)
+FILTER_COMPARISONS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+
+class LRUCache:
+    """
+    A small thread-safe LRU cache, for sort permutations and filter masks.
+
+    Args:
+        maxsize (int): largest number of entries kept.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return value
+
+
+def parse_filter_query(filter_query: str) -> list:
+    """
+    A function to parse a DataTable filter query, as produced by the table's
+    filter row: conditions joined with "&&".
+
+    Args:
+        filter_query (str): e.g. '{Credit Amount} > 1000 && {Gender} eq "female"'.
+
+    Raises:
+        ValueError: if a condition cannot be parsed or uses an unsupported
+            operator.
+
+    Returns:
+        (list): (column, operator, value, case_sensitive) tuples.
+    """
+
+    conditions = []
+
+    for part in (filter_query or "").split("&&"):
+        part = part.strip()
+        if not part:
+            continue
+
+        match = FILTER_CONDITION.match(part)
+        if match is None:
+            raise ValueError("Invalid filter: {}".format(part))
+
+        column, operator, value = match.group("column", "operator", "value")
+        operator = operator.lower()
+        value = value.strip()
+
+        # Unary operators, which have no s/i prefix: "is nil", "is blank"
+        if operator == "is":
+            if value not in ("nil", "blank"):
+                raise ValueError("Unsupported filter: {}".format(part))
+            conditions.append((column, "blank", None, True))
+            continue
+
+        case_sensitive = True
+        if operator not in FILTER_OPERATORS and operator[:1] in ("s", "i"):
+            case_sensitive = operator[0] == "s"
+            operator = operator[1:]
+
+        if operator not in FILTER_OPERATORS:
+            raise ValueError("Unsupported filter operator: {}".format(part))
+
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+            value = value[1:-1]
+
+        conditions.append((column, FILTER_OPERATORS[operator], value, case_sensitive))
+
+    return conditions
+
+
+class PopulationExplorer:
+    """
+    Server-side filtering, sorting and pagination over a read-only table, for a
+    DataTable with page_action, filter_action and sort_action set to "custom".
+
+    Columns are kept as NumPy arrays. Filters are evaluated as vectorized boolean
+    masks and sort orders as permutations; both are cached (LRU), so paging
+    through a filtered and sorted view only slices a cached permutation.
+
+    Args:
+        data (pandas.DataFrame): the table, with the DataTable's column ids.
+    """
+
+    def __init__(self, data: pandas.DataFrame):
+        self.data = data.reset_index(drop=True)
+        self.columns = {name: self.data[name].to_numpy() for name in self.data}
+        self._ranks = {}
+        self._strings = {}
+        self._masks = LRUCache()
+        self._orders = LRUCache()
+
+    def _column_ranks(self, name: str) -> numpy.ndarray:
+        # Dense ranks of a column's values, shared by all sort orders using it
+        if name not in self._ranks:
+            self._ranks[name] = numpy.unique(self.columns[name], return_inverse=True)[1]
+        return self._ranks[name]
+
+    def _column_strings(self, name: str) -> numpy.ndarray:
+        if name not in self._strings:
+            self._strings[name] = self.columns[name].astype(str)
+        return self._strings[name]
+
+    def _condition_mask(self, column, operator, value, case_sensitive) -> numpy.ndarray:
+        values = self.columns[column]
+
+        if operator == "blank":
+            return pandas.isna(values) | (values == "")
+
+        if operator in ("contains", "datestartswith"):
+            strings = self._column_strings(column)
+            if not case_sensitive:
+                strings, value = numpy.char.lower(strings), value.lower()
+            if operator == "contains":
+                return numpy.char.find(strings, value) >= 0
+            return numpy.char.startswith(strings, value)
+
+        if values.dtype.kind in "iufb":
+            try:
+                value = float(value)
+            except ValueError:
+                return numpy.zeros(len(values), dtype=bool)
+        elif not case_sensitive:
+            values, value = (
+                numpy.char.lower(self._column_strings(column)),
+                value.lower(),
+            )
+
+        compare = FILTER_COMPARISONS[operator]
+
+        return numpy.asarray(compare(values, value), dtype=bool)
+
+    def filter_mask(self, filter_query: str) -> numpy.ndarray:
+        """
+        Args:
+            filter_query (str): DataTable filter query.
+
+        Raises:
+            ValueError: if the filter query is invalid (see parse_filter_query).
+
+        Returns:
+            (numpy.ndarray): boolean mask of the rows passing the filter, or None
+                if nothing is filtered.
+        """
+
+        conditions = [
+            condition
+            for condition in parse_filter_query(filter_query)
+            if condition[0] in self.columns
+        ]
+        if not conditions:
+            return None
+
+        def compute():
+            mask = numpy.ones(len(self.data), dtype=bool)
+            for condition in conditions:
+                mask &= self._condition_mask(*condition)
+            mask.setflags(write=False)
+            return mask
+
+        return self._masks.get(tuple(conditions), compute)
+
+    def sort_order(self, sort_by: list) -> numpy.ndarray:
+        """
+        Args:
+            sort_by (list): DataTable sort_by, e.g. [{"column_id": ..., "direction":
+                "asc" or "desc"}], first column first.
+
+        Returns:
+            (numpy.ndarray): permutation of the rows, or None if nothing is sorted.
+        """
+
+        keys = tuple(
+            (item["column_id"], item["direction"])
+            for item in sort_by or []
+            if item.get("column_id") in self.columns
+        )
+        if not keys:
+            return None
+
+        def compute():
+            # lexsort sorts by the last key first; stable for equal rows
+            order = numpy.lexsort(
+                [
+                    self._column_ranks(name) * (1 if direction == "asc" else -1)
+                    for name, direction in reversed(keys)
+                ]
+            )
+            order.setflags(write=False)
+            return order
+
+        return self._orders.get(keys, compute)
+
+    def page(
+        self, page_current: int, page_size: int, sort_by: list, filter_query: str
+    ) -> tuple:
+        """
+        One page of the filtered and sorted table.
+
+        Args:
+            page_current (int): page number, from 0.
+            page_size (int): rows per page.
+            sort_by (list): DataTable sort_by.
+            filter_query (str): DataTable filter query.
+
+        Raises:
+            ValueError: if the filter query is invalid (see parse_filter_query).
+
+        Returns:
+            (tuple): rows of the page (list of dicts), number of pages and number
+                of rows passing the filter.
+        """
+
+        order = self.sort_order(sort_by)
+        mask = self.filter_mask(filter_query)
+
+        if order is None:
+            positions = (
+                numpy.arange(len(self.data))
+                if mask is None
+                else numpy.flatnonzero(mask)
+            )
+        else:
+            positions = order if mask is None else order[mask[order]]
+
+        page_count = max(1, math.ceil(len(positions) / page_size))
+        page_current = min(max(page_current or 0, 0), page_count - 1)
+
+        start = page_current * page_size
+        rows = self.data.iloc[positions[start : start + page_size]]
+
+        return rows.to_dict(orient="records"), page_count, len(positions)
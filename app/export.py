@@ -0,0 +1,141 @@
+import numpy
+import pandas
+
+from .german_credit import score_batch
+
+
+def iter_csv(frames: list, chunk_size: int = 10000):
+    """
+    A generator of CSV text for one or more DataFrames, written one after the
+    other and separated by an empty line. Each frame is written in chunks of rows,
+    so that a streamed response never holds the whole CSV in memory.
+
+    Args:
+        frames (list): DataFrames to write.
+        chunk_size (int): number of rows per chunk.
+
+    Yields:
+        (str): CSV text.
+    """
+
+    for i, frame in enumerate(frames):
+        if i > 0:
+            yield "\n"
+
+        yield frame.iloc[0:0].to_csv(index=False)
+
+        for start in range(0, len(frame), chunk_size):
+            yield frame.iloc[start : start + chunk_size].to_csv(
+                index=False, header=False
+            )
+
+
+def iter_scored_csv(reference_data, positions=None, chunk_size: int = 10000):
+    """
+    A generator of CSV text for scored reference records: every column of the
+    reference data, plus probability_of_default and predicted_score. Records are
+    selected, scored (unless scores were precomputed) and written one chunk at a
+    time.
+
+    Args:
+        reference_data (ReferenceData): the reference data store.
+        positions (numpy.ndarray): positions of the records to export, in output
+            order. Defaults to the whole reference set.
+        chunk_size (int): number of records per chunk.
+
+    Yields:
+        (str): CSV text.
+    """
+
+    if positions is None:
+        positions = numpy.arange(len(reference_data.data))
+
+    header = reference_data.data.iloc[0:0].assign(
+        probability_of_default=[], predicted_score=[]
+    )
+    yield header.to_csv(index=False)
+
+    for start in range(0, len(positions), chunk_size):
+        chunk_positions = positions[start : start + chunk_size]
+        chunk = reference_data.data.iloc[chunk_positions]
+
+        if reference_data.probabilities is not None:
+            probabilities = reference_data.probabilities[chunk_positions]
+            predictions = reference_data.predictions[chunk_positions]
+        else:
+            probabilities, predictions = score_batch(chunk, observe=False)
+
+        yield chunk.assign(
+            probability_of_default=probabilities, predicted_score=predictions
+        ).to_csv(index=False, header=False)
+
+
+def parse_ids(values: list) -> list:
+    """
+    A function to parse record ids given as query string values, either repeated
+    (?ids=1&ids=2) or comma-separated (?ids=1,2).
+
+    Args:
+        values (list): query string values.
+
+    Raises:
+        ValueError: if an id is not an integer.
+
+    Returns:
+        (list): record ids.
+    """
+
+    return [int(id) for value in values for id in value.split(",") if id.strip()]
+
+
+def parse_json_ids(body) -> list:
+    """
+    A function to parse record ids given in a JSON body ({"ids": [1, 2]}).
+
+    Args:
+        body: decoded JSON body.
+
+    Raises:
+        ValueError: if the body is not an object, its ids not a list or an id not
+            an integer.
+
+    Returns:
+        (list): record ids.
+    """
+
+    if not isinstance(body, dict):
+        raise ValueError("The JSON body must be an object")
+
+    ids = body.get("ids", [])
+    if not isinstance(ids, list) or not all(
+        isinstance(id, int) and not isinstance(id, bool) for id in ids
+    ):
+        raise ValueError("ids must be a list of integers")
+
+    return ids
+
+
+def summary_frame(
+    id, prediction: str, probability_of_default: float
+) -> pandas.DataFrame:
+    """
+    A function to build the one-row summary written at the end of a record export.
+
+    Args:
+        id: record id.
+        prediction (str): predicted score ("Default"/"Pay-Off").
+        probability_of_default (float): predicted probability of default.
+
+    Returns:
+        (pandas.DataFrame): the summary.
+    """
+
+    return pandas.DataFrame(
+        [
+            {
+                "ID": id,
+                "Logistic Regression Prediction": prediction,
+                "Probability of Default": probability_of_default,
+            }
+        ]
+    )
@@ -0,0 +1,171 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from .events import event_log
+from .workers import BackgroundWorker
+
+
+class FeedbackWriter(BackgroundWorker):
+    """
+    An append-only JSON lines store of user feedback, written in the background.
+
+    submit only puts the entry on an in-memory queue, so the request path never
+    waits on the disk. A background thread takes the queued entries in batches,
+    appends each batch with a single write and makes it durable with a single
+    fsync. Entries are never rewritten: the file can be read while it grows, and
+    all worker processes can append to the same file (O_APPEND).
+
+    Args:
+        path (str): JSON lines file, created if missing.
+        max_batch_size (int): largest number of entries per write and fsync.
+        flush_interval (float): longest time (seconds) an entry waits for others
+            to join its batch.
+        max_queue_depth (int): largest number of queued entries. Beyond it, new
+            entries are dropped (and counted) rather than blocking the caller.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_queue_depth: int = 10000,
+    ):
+        super().__init__(max_queue_depth)
+        self.path = path
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def submit(self, entry: dict) -> bool:
+        """
+        Queue a feedback entry for writing.
+
+        Args:
+            entry (dict): JSON-serializable feedback entry.
+
+        Returns:
+            (bool): whether the entry was queued (False if the queue is full).
+        """
+
+        try:
+            self._ensure_started().put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def flush(self, timeout: float = None) -> None:
+        """
+        Wait until all queued entries have been written.
+
+        Args:
+            timeout (float): seconds to wait; waits indefinitely if None.
+        """
+
+        if not self._started():
+            return
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+
+    def _run(self, pending: queue.Queue) -> None:
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(
+                        pending.get(timeout=remaining)
+                        if remaining > 0
+                        else pending.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    pending.task_done()
+
+    def _write(self, batch: list) -> None:
+        lines = "".join(json.dumps(entry) + "\n" for entry in batch).encode()
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            descriptor = os.open(
+                self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+            try:
+                os.write(descriptor, lines)
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+        except OSError as error:
+            event_log.emit(
+                "feedback_write_failure", entries=len(batch), error=str(error)
+            )
+            with self._lock:
+                self.failed += len(batch)
+            return
+
+        with self._lock:
+            self.written += len(batch)
+            self.flushes += 1
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            (dict): number of entries submitted, written, dropped (queue full) and
+                failed (write errors), number of flushes (fsync calls) and current
+                queue depth.
+        """
+
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "flushes": self.flushes,
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            }
+
+
+def create_feedback_writer() -> FeedbackWriter:
+    """
+    A function to create the feedback writer configured by environment variables:
+    FEEDBACK_PATH (JSON lines file), FEEDBACK_BATCH_SIZE and FEEDBACK_FLUSH_SECONDS.
+
+    Returns:
+        (FeedbackWriter): the feedback writer.
+    """
+
+    return FeedbackWriter(
+        os.environ.get("FEEDBACK_PATH", "/app/data/feedback.jsonl"),
+        max_batch_size=int(os.environ.get("FEEDBACK_BATCH_SIZE", 256)),
+        flush_interval=float(os.environ.get("FEEDBACK_FLUSH_SECONDS", 1.0)),
+    )
@@ -1,68 +1,565 @@
+import collections
+import hashlib
+import os
 import pickle
-import pandas
+import threading
 import numpy
 
+# pandas and sklearn (through the pickled model) are imported on first use only:
+# scoring with the compiled kernel needs NumPy alone
+from .events import event_log
+from .kernel import compile_model, load_kernel, save_kernel
+from .metrics import registry
 
-def init() -> None:
+# Alternitavely, these features can be saved (pickled) and re-loaded
+predictive_features = sorted(
+    [
+        "checking_status",
+        "credit_amount",
+        "credit_history",
+        "debtors_guarantors",
+        "duration_months",
+        "foreign_worker",
+        "housing",
+        "installment_plans",
+        "installment_rate",
+        "job",
+        "number_existing_credits",
+        "number_people_liable",
+        "present_employment_since",
+        "present_residence_since",
+        "property",
+        "purpose",
+        "savings_account",
+        "telephone",
+    ]
+)
+
+
+class ScoreCache:
+    """
+    A bounded, thread-safe LRU cache of (probability_of_default, predicted_score)
+    pairs, with hit/miss/eviction counters.
+
+    Args:
+        maxsize (int): maximum number of cached predictions.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            (dict): current size, capacity and hit/miss/eviction counters.
+        """
+
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Predictions cached in front of score()
+score_cache = ScoreCache()
+
+
+class ScoringModel:
+    """
+    A loaded model artifact: the compiled NumPy kernel when the model type is
+    supported, and the sklearn model, unpickled on first use.
+
+    The compiled kernel is saved next to the artifact, keyed by its sha256. When
+    a saved kernel matches the artifact, the model is not unpickled (and sklearn
+    not imported) until something needs it.
+
+    Args:
+        model_path (str): location of the pickled model artifact.
+        cache_dir (str): directory of the saved kernel. Defaults to a ".cache"
+            directory next to the artifact.
+        version (str): name of the model version. Defaults to the start of the
+            artifact's sha256.
+    """
+
+    def __init__(self, model_path: str, cache_dir: str = None, version: str = None):
+        with open(model_path, "rb") as artifact:
+            self._artifact = artifact.read()
+
+        self.path = model_path
+        self.digest = hashlib.sha256(self._artifact).hexdigest()
+        self.version = version or self.digest[:12]
+        self._model = None
+        self._lock = threading.Lock()
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(model_path), ".cache")
+        self.kernel_path = os.path.join(
+            cache_dir, os.path.basename(model_path) + ".kernel.json"
+        )
+
+        saved = load_kernel(self.kernel_path, self.digest)
+        if saved is not None:
+            self.kernel, self.kernel_validated = saved
+            return
+
+        # Lookup tables + coefficients for the hot path; sklearn is used otherwise
+        self.kernel = compile_model(self.model)
+        self.kernel_validated = False
+
+        if self.kernel is not None:
+            try:
+                save_kernel(self.kernel, self.kernel_path, self.digest)
+            except OSError as error:
+                event_log.emit(
+                    "kernel_save_failure", version=self.version, error=str(error)
+                )
+
+    @property
+    def model(self):
+        """
+        The fitted sklearn model, unpickled on first access.
+        """
+
+        with self._lock:
+            if self._model is None:
+                # load pickled logistic regression model
+                self._model = pickle.loads(self._artifact)
+            return self._model
+
+    def predict_proba(self, columns) -> numpy.ndarray:
+        """
+        Class probabilities, with the compiled kernel if available.
+
+        Args:
+            columns: mapping of feature name -> 1-D array of values (a dict of
+                arrays, a pandas.DataFrame or a NumPy structured array).
+
+        Returns:
+            (numpy.ndarray): probabilities of shape (records, 2), as predict_proba.
+        """
+
+        if self.kernel is not None:
+            return self.kernel.predict_proba(columns)
+
+        import pandas
+
+        data = pandas.DataFrame({name: columns[name] for name in predictive_features})
+
+        # Treat number_people_liable as categorical, as done in score()
+        data = data.astype({"number_people_liable": "category"})
+
+        return self.model.predict_proba(data)
+
+    def contributions(self, columns) -> numpy.ndarray:
+        """
+        Per-feature log-odds contributions, with the compiled kernel.
+
+        Args:
+            columns: mapping of feature name -> 1-D array of values.
+
+        Returns:
+            (numpy.ndarray): contributions of shape (records, features), with
+                features in predictive_features order, or None if the model could
+                not be compiled (explanations need a linear model).
+        """
+
+        if self.kernel is None:
+            return None
+
+        contributions = self.kernel.contributions(columns)
+
+        if self.kernel.features != predictive_features:
+            contributions = contributions[
+                :, [self.kernel.features.index(name) for name in predictive_features]
+            ]
+
+        return contributions
+
+    def validate(self, data: "pandas.DataFrame", tolerance: float = 1e-9) -> float:
+        """
+        Check the compiled kernel against sklearn on a set of records. The kernel
+        is disabled (sklearn is used instead) if they disagree. A kernel is only
+        checked once per artifact: the result is saved with the kernel.
+
+        Args:
+            data (pandas.DataFrame): records to be checked, e.g. the reference set.
+            tolerance (float): largest absolute difference allowed in probabilities.
+
+        Returns:
+            (float): largest absolute difference found (0.0 if there is no kernel
+                or it has already been checked).
+        """
+
+        if self.kernel is None or self.kernel_validated or len(data) == 0:
+            return 0.0
+
+        expected = self.model.predict_proba(
+            data[predictive_features].astype({"number_people_liable": "category"})
+        )
+        difference = float(numpy.abs(self.kernel.predict_proba(data) - expected).max())
+
+        if difference > tolerance:
+            # Serving falls back to sklearn
+            event_log.emit(
+                "kernel_mismatch", version=self.version, difference=difference
+            )
+            self.kernel = None
+            try:
+                os.unlink(self.kernel_path)
+            except OSError:
+                pass
+            return difference
+
+        self.kernel_validated = True
+        try:
+            save_kernel(self.kernel, self.kernel_path, self.digest, validated=True)
+        except OSError:
+            pass
+
+        return difference
+
+
+# Model used by score() and score_batch(). Replaced as a whole by activate(), so
+# that a request in flight keeps the model it started with
+active_model = None
+
+# Called with (columns, probabilities) after each scoring call of live traffic
+# (not reference records), e.g. to score a sample of it with a challenger model
+# (see registry.ShadowScorer)
+shadow_hook = None
+
+# Input drift monitor (see drift.DriftMonitor), fed with the records scored by
+# score() and score_batch(), except reference records
+drift_monitor = None
+
+# Time spent in each stage of score() and score_batch()
+score_stage_duration = registry.histogram(
+    "model_score_stage_duration_seconds",
+    "Time spent in each stage of scoring: cache lookup, compiled kernel, "
+    "DataFrame build, predict_proba and serialization.",
+    ("function", "stage"),
+)
+
+
+def activate(model: ScoringModel) -> None:
+    """
+    A function to make a loaded model the one used for scoring. The swap is a
+    single assignment: calls in flight finish with the previous model.
+
+    Args:
+        model (ScoringModel): the model.
+    """
+
+    global active_model
+
+    previous, active_model = active_model, model
+
+    # Cache keys include the model digest; drop the previous model's entries
+    if previous is not None and previous.digest != model.digest:
+        score_cache.clear()
+
+
+def init(
+    model_path: str = "/app/data/logreg_classifier.pickle", cache_dir: str = None
+) -> None:
     """
     A function to load the trained model artifact (.pickle) as a glocal variable.
-    The model will be used by other functions to produce predictions.
+    The model will be used by other functions to produce predictions, through a
+    compiled NumPy kernel when the model type is supported.
+    Cached predictions are dropped if the artifact differs from the one loaded before.
+
+    Args:
+        model_path (str): location of the pickled model artifact.
+        cache_dir (str): directory of the saved kernel. Defaults to a ".cache"
+            directory next to the artifact.
+    """
+
+    activate(ScoringModel(model_path, cache_dir))
+
+
+def load_model():
+    """
+    A function to get the active sklearn model, unpickling it on first use. Also
+    available as german_credit.logreg_classifier.
+
+    Returns:
+        the fitted model.
+    """
+
+    return active_model.model
+
+
+def __getattr__(name: str):
+    # german_credit.logreg_classifier: the sklearn model of the active model,
+    # unpickled on first access
+    if name == "logreg_classifier":
+        return load_model()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def score_cache_key(data: dict, reference_id=None) -> tuple:
     """
+    A function to compute the key of a record in score_cache: the record id for
+    records from the reference set, the 18 predictive features otherwise.
 
-    global logreg_classifier
-    # load pickled logistic regression model
-    logreg_classifier = pickle.load(open("/app/data/logreg_classifier.pickle", "rb"))
+    Args:
+        data (dict): record to be scored.
+        reference_id: id of the record in the reference set, if it comes from it.
 
+    Returns:
+        (tuple): cache key.
+    """
 
-def score(data: dict) -> dict:
+    if reference_id is not None:
+        return ("id", reference_id)
+
+    # Canonical form: feature values in predictive_features order, with NumPy
+    # scalars turned into Python ones so that equal records hash equally
+    return (
+        "features",
+        tuple(
+            value.item() if isinstance(value, numpy.generic) else value
+            for value in (data[name] for name in predictive_features)
+        ),
+    )
+
+
+def fast_predict_proba(columns) -> numpy.ndarray:
+    """
+    A function to compute class probabilities with the compiled NumPy kernel of
+    the active model, or with the sklearn model if it could not be compiled.
+
+    Args:
+        columns: mapping of feature name -> 1-D array of values (a dict of arrays,
+            a pandas.DataFrame or a NumPy structured array).
+
+    Returns:
+        (numpy.ndarray): probabilities of shape (records, 2), as predict_proba.
+    """
+
+    return active_model.predict_proba(columns)
+
+
+def validate_fast_predict_proba(
+    data: "pandas.DataFrame", tolerance: float = 1e-9
+) -> float:
+    """
+    A function to check the compiled kernel of the active model against sklearn
+    on a set of records (see ScoringModel.validate).
+
+    Args:
+        data (pandas.DataFrame): records to be checked, e.g. the reference set.
+        tolerance (float): largest absolute difference allowed in probabilities.
+
+    Returns:
+        (float): largest absolute difference found.
+    """
+
+    return active_model.validate(data, tolerance)
+
+
+def score(data: dict, reference_id=None) -> dict:
     """
     A function to predict loan default/pay-off, given a loan application sample (record).
+    Predictions are memoized in score_cache.
 
     Args:
         data (dict): input dictionary to be scored, containing predictive features.
+        reference_id: id of the record in the reference set, if it comes from it.
+            Used as cache key instead of the record's predictive features.
 
     Returns:
         (dict): Scored (predicted) input data.
     """
 
-    # Turn input data into a 1-record DataFrame
-    data = pandas.DataFrame([data])
-
-    # There are only two unique values in data.number_people_liable.
-    # Treat it as a categorical feature, to mimic training process
-    data.number_people_liable = data.number_people_liable.astype("category")
-
-    # Alternitavely, these features can be saved (pickled) and re-loaded
-    predictive_features = sorted(
-        [
-            "checking_status",
-            "credit_amount",
-            "credit_history",
-            "debtors_guarantors",
-            "duration_months",
-            "foreign_worker",
-            "housing",
-            "installment_plans",
-            "installment_rate",
-            "job",
-            "number_existing_credits",
-            "number_people_liable",
-            "present_employment_since",
-            "present_residence_since",
-            "property",
-            "purpose",
-            "savings_account",
-            "telephone",
-        ]
-    )
+    # The same model for the whole call, even if another one is activated
+    model = active_model
 
-    # Predict using saved model
-    probability = numpy.round(
-        logreg_classifier.predict_proba(data[predictive_features])[0][1], 3
-    )
+    if drift_monitor is not None and reference_id is None:
+        drift_monitor.observe(data)
+
+    with score_stage_duration.time("score", "cache_lookup"):
+        key = (model.digest, score_cache_key(data, reference_id))
+        cached = score_cache.get(key)
+
+    if cached is not None:
+        probability, prediction = cached
+        return dict(
+            data, probability_of_default=probability, predicted_score=prediction
+        )
+
+    if model.kernel is not None:
+        with score_stage_duration.time("score", "kernel"):
+            probability = round(model.kernel.predict_proba_record(data), 3)
+            prediction = "Default" if probability > 0.5 else "Pay-Off"
+
+        score_cache.put(key, (probability, prediction))
+
+        if shadow_hook is not None and reference_id is None:
+            shadow_hook([data], numpy.array([probability]))
+
+        return dict(
+            data, probability_of_default=probability, predicted_score=prediction
+        )
+
+    record = data
+
+    import pandas
+
+    with score_stage_duration.time("score", "dataframe_build"):
+        # Turn input data into a 1-record DataFrame
+        data = pandas.DataFrame([data])
+
+        # There are only two unique values in data.number_people_liable.
+        # Treat it as a categorical feature, to mimic training process
+        data.number_people_liable = data.number_people_liable.astype("category")
+
+    with score_stage_duration.time("score", "predict_proba"):
+        # Predict using saved model
+        probability = numpy.round(
+            model.model.predict_proba(data[predictive_features])[0][1], 3
+        )
+
+    with score_stage_duration.time("score", "serialization"):
+        data["probability_of_default"] = probability
+
+        data["predicted_score"] = "Default" if probability > 0.5 else "Pay-Off"
+
+        scored = data.to_dict(orient="records")[0]
+
+    score_cache.put(key, (scored["probability_of_default"], scored["predicted_score"]))
+
+    if shadow_hook is not None and reference_id is None:
+        shadow_hook([record], numpy.array([probability]))
+
+    return scored
+
+
+def score_batch(data, observe: bool = True) -> tuple:
+    """
+    A function to predict loan default/pay-off for many loan applications at once,
+    using a single call to the model.
+
+    Args:
+        data (list | pandas.DataFrame | dict | numpy.ndarray): records to be scored.
+            Either a list of dicts, a DataFrame, a dict of equal-length columns
+            (arrays) or a NumPy structured array, containing predictive features.
+        observe (bool): whether the records are live traffic, added to
+            drift_monitor and sampled by shadow_hook (False for reference records).
+
+    Returns:
+        (tuple): Probabilities of default (numpy.ndarray of floats) and predicted
+            scores (numpy.ndarray of "Default"/"Pay-Off" labels), in input order.
+    """
+
+    with score_stage_duration.time("score_batch", "dataframe_build"):
+        if isinstance(data, list):
+            columns = {
+                name: [record[name] for record in data] for name in predictive_features
+            }
+        else:
+            # DataFrame, dict of columns or structured array
+            columns = data
+
+    if len(columns[predictive_features[0]]) == 0:
+        return numpy.empty(0), numpy.empty(0, dtype=object)
+
+    with score_stage_duration.time("score_batch", "predict_proba"):
+        probabilities = numpy.round(active_model.predict_proba(columns)[:, 1], 3)
+
+    # Only once scored: records of a failed batch are scored again one by one
+    # (see batching.MicroBatcher), and must only be counted then
+    if drift_monitor is not None and observe:
+        drift_monitor.observe_batch(columns)
+
+    if shadow_hook is not None and observe:
+        shadow_hook(columns, probabilities)
+
+    with score_stage_duration.time("score_batch", "serialization"):
+        labels = numpy.where(probabilities > 0.5, "Default", "Pay-Off").astype(object)
+
+    return probabilities, labels
+
+
+def explain(data: dict) -> dict:
+    """
+    A function to explain the prediction for a loan application sample (record):
+    the contribution of each predictive feature to the log-odds of default, with
+    the same lookups as score() (no DataFrame, no second model call).
+
+    Args:
+        data (dict): record to be explained, containing predictive features.
+
+    Returns:
+        (dict): predictive feature -> contribution to the log-odds (positive values
+            push towards Default), or None if the active model cannot be explained.
+    """
+
+    kernel = active_model.kernel
+    if kernel is None:
+        return None
+
+    return dict(zip(kernel.features, kernel.contributions_record(data)))
+
+
+def explain_batch(data) -> numpy.ndarray:
+    """
+    A function to explain the predictions for many loan applications at once, in
+    one matrix operation.
+
+    Args:
+        data (list | pandas.DataFrame | dict | numpy.ndarray): records to be
+            explained, as in score_batch.
+
+    Returns:
+        (numpy.ndarray): contributions to the log-odds of default, of shape
+            (records, len(predictive_features)), or None if the active model
+            cannot be explained.
+    """
+
+    model = active_model
+    if model.kernel is None:
+        return None
 
-    data["probability_of_default"] = probability
+    if isinstance(data, list):
+        data = {name: [record[name] for record in data] for name in predictive_features}
 
-    data["predicted_score"] = "Default" if probability > 0.5 else "Pay-Off"
+    if len(data[predictive_features[0]]) == 0:
+        return numpy.empty((0, len(predictive_features)))
 
-    return data.to_dict(orient="records")[0]
+    return model.contributions(data)
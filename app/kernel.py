@@ -0,0 +1,360 @@
+import json
+import os
+import tempfile
+
+import numpy
+
+# Bump when the layout of saved kernels changes, so that old files are ignored
+KERNEL_VERSION = 1
+
+
+class LinearKernel:
+    """
+    A flat NumPy representation of a fitted one-hot encoder + binary logistic
+    regression pipeline.
+
+    Encoding a value and multiplying it by the coefficient vector amounts to
+    looking up the coefficient of that value's one-hot column. So for each feature
+    the kernel keeps a lookup table (sorted categories -> coefficient) and the
+    log-odds of a record are the intercept plus one lookup per feature.
+
+    Attributes:
+        features (list): input feature names, in model order.
+        categories (list): sorted category values (numpy.ndarray) per feature.
+        weights (list): coefficient (numpy.ndarray of floats) per category, per
+            feature. Dropped categories have a weight of 0.
+        intercept (float): intercept of the logistic regression.
+        scale (float): 2 for multinomial (softmax) models, 1 for one-vs-rest.
+        ignore_unknown (bool): whether unknown categories contribute 0 (as with
+            handle_unknown="ignore") or raise a ValueError.
+    """
+
+    def __init__(
+        self,
+        features: list,
+        categories: list,
+        weights: list,
+        intercept: float,
+        scale: float = 1.0,
+        ignore_unknown: bool = True,
+    ):
+        self.features = list(features)
+        self.categories = categories
+        self.weights = weights
+        self.intercept = intercept
+        self.scale = scale
+        self.ignore_unknown = ignore_unknown
+
+        # Hash tables for the single-record path
+        self.lookups = [
+            dict(zip(feature_categories.tolist(), feature_weights.tolist()))
+            for feature_categories, feature_weights in zip(categories, weights)
+        ]
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            (dict): JSON-serializable state of the kernel (see from_dict).
+        """
+
+        return {
+            "features": self.features,
+            "categories": [categories.tolist() for categories in self.categories],
+            "dtypes": [str(categories.dtype) for categories in self.categories],
+            "weights": [weights.tolist() for weights in self.weights],
+            "intercept": self.intercept,
+            "scale": self.scale,
+            "ignore_unknown": self.ignore_unknown,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        """
+        Args:
+            state (dict): state of a kernel, as returned by to_dict.
+
+        Returns:
+            (LinearKernel): the kernel.
+        """
+
+        return cls(
+            features=state["features"],
+            categories=[
+                numpy.array(categories, dtype=dtype)
+                for categories, dtype in zip(state["categories"], state["dtypes"])
+            ],
+            weights=[numpy.array(weights, dtype=float) for weights in state["weights"]],
+            intercept=state["intercept"],
+            scale=state["scale"],
+            ignore_unknown=state["ignore_unknown"],
+        )
+
+    def _feature_weights(self, name: str, categories, weights, columns):
+        # Weight of each record's category for one feature (0 if unknown)
+        values = numpy.asarray(columns[name])
+        if categories.dtype == object:
+            values = values.astype(object)
+
+        positions = numpy.searchsorted(categories, values)
+        numpy.minimum(positions, len(categories) - 1, out=positions)
+        found = categories[positions] == values
+
+        if not self.ignore_unknown and not found.all():
+            raise ValueError(
+                "Found unknown categories in column {}: {}".format(
+                    name, numpy.unique(values[~found]).tolist()
+                )
+            )
+
+        return numpy.where(found, weights[positions], 0.0)
+
+    def decision_function(self, columns) -> numpy.ndarray:
+        """
+        Log-odds of the positive class for a batch of records.
+
+        Args:
+            columns: mapping of feature name -> 1-D array of values (a dict of arrays,
+                a pandas.DataFrame or a NumPy structured array).
+
+        Returns:
+            (numpy.ndarray): log-odds, one per record.
+        """
+
+        logits = None
+
+        for name, categories, weights in zip(
+            self.features, self.categories, self.weights
+        ):
+            contribution = self._feature_weights(name, categories, weights, columns)
+            logits = contribution if logits is None else logits + contribution
+
+        return logits + self.intercept
+
+    def contributions(self, columns) -> numpy.ndarray:
+        """
+        Contribution of each feature to the log-odds of the positive class, for a
+        batch of records: the coefficient of the one-hot column of the record's
+        category (coefficient x encoded value, summed over the feature's columns).
+        The log-odds of a record are the sum of its contributions plus
+        scale * intercept.
+
+        Args:
+            columns: mapping of feature name -> 1-D array of values.
+
+        Returns:
+            (numpy.ndarray): contributions of shape (records, features), with
+                features in the order of the features attribute.
+        """
+
+        return self.scale * numpy.column_stack(
+            [
+                self._feature_weights(name, categories, weights, columns)
+                for name, categories, weights in zip(
+                    self.features, self.categories, self.weights
+                )
+            ]
+        )
+
+    def contributions_record(self, record: dict) -> list:
+        """
+        Contribution of each feature to the log-odds of a single record (dict
+        lookups only), as contributions.
+
+        Args:
+            record (dict): record to be explained, containing the model's features.
+
+        Returns:
+            (list): contributions (floats), in the order of the features attribute.
+        """
+
+        contributions = []
+
+        for name, lookup in zip(self.features, self.lookups):
+            value = record[name]
+            if isinstance(value, numpy.generic):
+                value = value.item()
+            weight = lookup.get(value)
+            if weight is None:
+                if not self.ignore_unknown:
+                    raise ValueError(
+                        "Found unknown categories in column {}: {}".format(
+                            name, [value]
+                        )
+                    )
+                weight = 0.0
+            contributions.append(self.scale * weight)
+
+        return contributions
+
+    def predict_proba(self, columns) -> numpy.ndarray:
+        """
+        Class probabilities for a batch of records, as sklearn's predict_proba.
+
+        Args:
+            columns: mapping of feature name -> 1-D array of values.
+
+        Returns:
+            (numpy.ndarray): probabilities of shape (records, 2).
+        """
+
+        positive = _expit(self.scale * self.decision_function(columns))
+
+        return numpy.column_stack((1.0 - positive, positive))
+
+    def predict_proba_record(self, record: dict) -> float:
+        """
+        Probability of the positive class for a single record (dict lookups only).
+
+        Args:
+            record (dict): record to be scored, containing the model's features.
+
+        Returns:
+            (float): probability of the positive class.
+        """
+
+        logit = self.intercept
+
+        for name, lookup in zip(self.features, self.lookups):
+            value = record[name]
+            if isinstance(value, numpy.generic):
+                value = value.item()
+            weight = lookup.get(value)
+            if weight is None:
+                if not self.ignore_unknown:
+                    raise ValueError(
+                        "Found unknown categories in column {}: {}".format(
+                            name, [value]
+                        )
+                    )
+                continue
+            logit += weight
+
+        return float(_expit(self.scale * numpy.float64(logit)))
+
+
+def _expit(x):
+    # Same formula as scipy.special.expit, which sklearn uses
+    return 1.0 / (1.0 + numpy.exp(-x))
+
+
+def compile_model(model) -> LinearKernel:
+    """
+    A function to export a fitted sklearn Pipeline(OneHotEncoder, LogisticRegression)
+    into a LinearKernel.
+
+    Args:
+        model: fitted model, as loaded from the pickled artifact.
+
+    Returns:
+        (LinearKernel): the compiled model, or None if the model type is not
+            supported (in which case sklearn should be used).
+    """
+
+    steps = getattr(model, "steps", None)
+    if steps is None or len(steps) != 2:
+        return None
+
+    (_, encoder), (_, classifier) = steps
+
+    if (
+        type(encoder).__name__ != "OneHotEncoder"
+        or type(classifier).__name__ != "LogisticRegression"
+        or getattr(encoder, "_infrequent_enabled", False)
+        or encoder.handle_unknown not in ("ignore", "error")
+        or not hasattr(encoder, "feature_names_in_")
+        or len(classifier.classes_) != 2
+    ):
+        return None
+
+    coefficients = classifier.coef_.ravel()
+    drop_idx = encoder.drop_idx_
+
+    categories = []
+    weights = []
+    offset = 0
+
+    for j, feature_categories in enumerate(encoder.categories_):
+        # Missing values need sklearn's NaN handling
+        if any(
+            value is None or value != value for value in feature_categories.tolist()
+        ):
+            return None
+
+        feature_weights = numpy.zeros(len(feature_categories))
+        if drop_idx is not None and drop_idx[j] is not None:
+            kept = numpy.ones(len(feature_categories), dtype=bool)
+            kept[drop_idx[j]] = False
+        else:
+            kept = slice(None)
+        n_columns = len(feature_weights[kept])
+        feature_weights[kept] = coefficients[offset : offset + n_columns]
+        offset += n_columns
+
+        categories.append(feature_categories)
+        weights.append(feature_weights)
+
+    if offset != len(coefficients):
+        return None
+
+    multinomial = classifier.multi_class == "multinomial"
+
+    return LinearKernel(
+        features=encoder.feature_names_in_,
+        categories=categories,
+        weights=weights,
+        intercept=float(classifier.intercept_[0]),
+        scale=2.0 if multinomial else 1.0,
+        ignore_unknown=encoder.handle_unknown == "ignore",
+    )
+
+
+def save_kernel(
+    kernel: LinearKernel, path: str, digest: str, validated: bool = False
+) -> None:
+    """
+    A function to save a compiled kernel as JSON (atomically), so that later
+    starts can skip unpickling the model and importing sklearn.
+
+    Args:
+        kernel (LinearKernel): the compiled kernel.
+        path (str): destination file.
+        digest (str): sha256 of the model artifact the kernel was compiled from.
+        validated (bool): whether the kernel was checked against the model.
+    """
+
+    state = dict(
+        kernel.to_dict(), version=KERNEL_VERSION, sha256=digest, validated=validated
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, "w") as target:
+            json.dump(state, target)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load_kernel(path: str, digest: str) -> tuple:
+    """
+    A function to load a kernel saved by save_kernel.
+
+    Args:
+        path (str): file written by save_kernel.
+        digest (str): sha256 of the current model artifact.
+
+    Returns:
+        (tuple): the kernel (LinearKernel) and whether it was validated, or None
+            if there is no usable file for this artifact.
+    """
+
+    try:
+        with open(path) as source:
+            state = json.load(source)
+        if state["version"] != KERNEL_VERSION or state["sha256"] != digest:
+            return None
+        return LinearKernel.from_dict(state), bool(state["validated"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
@@ -0,0 +1,171 @@
+import numpy
+import pandas
+
+
+def encode_features(data: pandas.DataFrame, columns: list = None) -> tuple:
+    """
+    A function to integer-code the columns of a DataFrame, to be used for matching.
+
+    Args:
+        data (pandas.DataFrame): records to be encoded.
+        columns (list): columns to encode. Defaults to all columns of data.
+
+    Returns:
+        (tuple): Encoded feature matrix (numpy.ndarray of shape (records, columns),
+            int32 codes) and a dict mapping each column to its vocabulary
+            (pandas.Index of unique values, position = code).
+    """
+
+    if columns is None:
+        columns = list(data.columns)
+
+    codes = numpy.empty((len(data), len(columns)), dtype=numpy.int32)
+    vocabularies = {}
+
+    for j, column in enumerate(columns):
+        # Missing values are coded as -1 and never match anything
+        codes[:, j], vocabularies[column] = pandas.factorize(data[column])
+
+    return codes, vocabularies
+
+
+def encode_record(record: dict, vocabularies: dict) -> numpy.ndarray:
+    """
+    A function to integer-code a single record, using vocabularies produced by
+    encode_features. Values not seen in the vocabulary are coded as -1.
+
+    Args:
+        record (dict): record to be encoded.
+        vocabularies (dict): column -> pandas.Index of unique values.
+
+    Returns:
+        (numpy.ndarray): int32 codes, one per column of vocabularies.
+    """
+
+    codes = numpy.full(len(vocabularies), -1, dtype=numpy.int32)
+
+    for j, (column, vocabulary) in enumerate(vocabularies.items()):
+        if column in record:
+            codes[j] = vocabulary.get_indexer([record[column]])[0]
+
+    return codes
+
+
+class MatchIndex:
+    """
+    Top-k matching engine over an encoded feature matrix.
+
+    Records are ranked by the number of columns whose value equals the query's;
+    ties are broken by position in the reference set (earlier records first).
+
+    Two modes are supported:
+        "dense": vectorized equality counts over the whole matrix, O(records * columns).
+        "inverted": per-column posting lists (row ids grouped by code). Only rows
+            sharing at least one value with the query are touched, which pays off
+            on very large reference sets with high-cardinality columns.
+    """
+
+    def __init__(self, codes: numpy.ndarray, mode: str = "dense"):
+        if mode not in ("dense", "inverted"):
+            raise ValueError("Unknown matching mode: {}".format(mode))
+
+        self.codes = codes
+        self.mode = mode
+        self.n_records, self.n_columns = codes.shape
+
+        if mode == "inverted":
+            self._build_postings()
+
+    def _build_postings(self) -> None:
+        # CSR-style layout per column: rows sorted by code, plus offsets per code
+        self._postings = []
+        self._offsets = []
+
+        for j in range(self.n_columns):
+            column = self.codes[:, j]
+            order = numpy.argsort(column, kind="stable").astype(numpy.int32)
+            n_codes = int(column.max()) + 1 if self.n_records else 0
+            # Missing values (-1) sort first and are excluded from postings
+            counts = numpy.bincount(column[column >= 0], minlength=n_codes)
+            missing = self.n_records - int(counts.sum())
+            offsets = numpy.concatenate(([0], numpy.cumsum(counts))) + missing
+            self._postings.append(order)
+            self._offsets.append(offsets)
+
+    def match_counts(self, query: numpy.ndarray) -> numpy.ndarray:
+        """
+        Number of columns each reference record shares with the query.
+
+        Args:
+            query (numpy.ndarray): encoded query record, one code per column.
+
+        Returns:
+            (numpy.ndarray): match count per reference record.
+        """
+
+        if self.mode == "dense":
+            # -1 (missing/unseen) in the query must not match missing values
+            query = numpy.where(query < 0, -2, query)
+            return (self.codes == query).sum(axis=1, dtype=numpy.int32)
+
+        hits = []
+        for j, code in enumerate(query):
+            offsets = self._offsets[j]
+            if 0 <= code < len(offsets) - 1:
+                hits.append(self._postings[j][offsets[code] : offsets[code + 1]])
+
+        if not hits:
+            return numpy.zeros(self.n_records, dtype=numpy.int32)
+
+        return numpy.bincount(numpy.concatenate(hits), minlength=self.n_records).astype(
+            numpy.int32
+        )
+
+    def top_k(
+        self,
+        query: numpy.ndarray,
+        k: int = 5,
+        exclude: int = None,
+        candidates: numpy.ndarray = None,
+    ) -> tuple:
+        """
+        Positions of the k reference records that best match the query.
+
+        Args:
+            query (numpy.ndarray): encoded query record, one code per column.
+            k (int): number of records to return.
+            exclude (int): position of a record to leave out (e.g. the query itself).
+            candidates (numpy.ndarray): boolean mask of the records that may be
+                returned. Defaults to all records.
+
+        Returns:
+            (tuple): Positions (numpy.ndarray) of the closest records, best first,
+                and their match counts.
+        """
+
+        counts = self.match_counts(query)
+
+        if exclude is not None:
+            counts[exclude] = -1
+        if candidates is not None:
+            counts[~candidates] = -1
+
+        k = min(k, self.n_records - (exclude is not None))
+        if k <= 0:
+            return numpy.empty(0, dtype=numpy.intp), numpy.empty(0, dtype=numpy.int32)
+
+        # argpartition finds the k-th best count; records tied at that count are
+        # then taken by position rather than in (arbitrary) partition order
+        top = numpy.argpartition(counts, self.n_records - k)[self.n_records - k :]
+        threshold = counts[top].min()
+        better = numpy.flatnonzero(counts > threshold)
+        tied = numpy.flatnonzero(counts == threshold)[: k - len(better)]
+        selected = numpy.concatenate((better, tied))
+
+        order = numpy.lexsort((selected, -counts[selected]))
+        positions = selected[order]
+
+        # Records left out (count -1) fill the top k when too few remain: drop them
+        positions = positions[counts[positions] >= 0]
+
+        return positions, counts[positions]
@@ -0,0 +1,260 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets, from 50us to 2.5s
+DEFAULT_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+class _NullTimer:
+    # Returned by Histogram.time when metrics are disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Histogram:
+    """
+    A thread-safe histogram of observed values (durations, in seconds), exposed
+    in the Prometheus text format: cumulative buckets, sum and count per set of
+    label values.
+
+    Args:
+        name (str): metric name.
+        documentation (str): help text.
+        labelnames (tuple): names of the labels.
+        buckets (tuple): sorted upper bounds of the buckets (+Inf is implied).
+        registry (MetricsRegistry): registry whose enabled flag is followed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+        registry=None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.registry = registry
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        """
+        Args:
+            value (float): observed value.
+            *labelvalues: one value per label name, in order.
+        """
+
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Bucket counts (the last one is +Inf), sum
+                series = self._series[labelvalues] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labelvalues):
+        """
+        A context manager observing the duration of its block, or doing nothing
+        if the registry is disabled.
+
+        Args:
+            *labelvalues: one value per label name, in order.
+        """
+
+        if self.registry is not None and not self.registry.enabled:
+            return _null_timer
+
+        return _Timer(self, labelvalues)
+
+    def timed(self, *labelvalues):
+        """
+        A decorator observing the duration of each call of the decorated function.
+
+        Args:
+            *labelvalues: one value per label name, in order.
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(*labelvalues):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def expose(self) -> list:
+        """
+        Returns:
+            (list): lines of the Prometheus text format.
+        """
+
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} histogram".format(self.name),
+        ]
+
+        with self._lock:
+            series = sorted(
+                (labelvalues, list(counts), total)
+                for labelvalues, (counts, total) in self._series.items()
+            )
+
+        for labelvalues, counts, total in series:
+            labels = [
+                '{}="{}"'.format(name, _escape(value))
+                for name, value in zip(self.labelnames, labelvalues)
+            ]
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    "{}_bucket{{{}}} {}".format(
+                        self.name, ",".join(labels + ['le="{}"'.format(le)]), cumulative
+                    )
+                )
+
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append("{}_sum{} {!r}".format(self.name, suffix, total))
+            lines.append("{}_count{} {}".format(self.name, suffix, cumulative))
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process: histograms, and counters and gauges read from
+    callables when the metrics are exposed (e.g. cache hits, cache size).
+
+    Args:
+        enabled (bool): whether Histogram.time measures anything. When disabled,
+            timed blocks cost a single attribute check.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._histograms = []
+        self._counters = []
+        self._gauges = []
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Create and register a histogram.
+
+        Returns:
+            (Histogram): the histogram.
+        """
+
+        histogram = Histogram(name, documentation, labelnames, buckets, registry=self)
+        self._histograms.append(histogram)
+        return histogram
+
+    def counter(self, name: str, documentation: str, function) -> None:
+        """
+        Register a counter: a value that only goes up (reset on restart).
+
+        Args:
+            name (str): metric name, ending in "_total".
+            documentation (str): help text.
+            function: callable returning the current count.
+        """
+
+        self._counters.append((name, documentation, function))
+
+    def gauge(self, name: str, documentation: str, function) -> None:
+        """
+        Register a gauge.
+
+        Args:
+            name (str): metric name.
+            documentation (str): help text.
+            function: callable returning the current value (a number).
+        """
+
+        self._gauges.append((name, documentation, function))
+
+    def expose(self) -> str:
+        """
+        Returns:
+            (str): all metrics in the Prometheus text format (version 0.0.4).
+        """
+
+        lines = []
+
+        for histogram in self._histograms:
+            lines.extend(histogram.expose())
+
+        for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+            for name, documentation, function in metrics:
+                lines.append("# HELP {} {}".format(name, documentation))
+                lines.append("# TYPE {} {}".format(name, kind))
+                lines.append("{} {!r}".format(name, float(function())))
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metrics of this process, disabled with METRICS_ENABLED=0
+registry = MetricsRegistry(enabled=os.environ.get("METRICS_ENABLED", "1") != "0")
@@ -0,0 +1,279 @@
+import time
+import types
+import typing
+
+import numpy
+import pandas
+
+from .events import event_log
+from .german_credit import explain_batch, predictive_features, score_batch
+from .matching import MatchIndex, encode_features
+from .similarity import SimilarityIndex
+
+
+class ReferenceData(typing.NamedTuple):
+    """
+    Read-only store of the reference records (training + testing data).
+
+    Built once at startup and shared by all request handlers. Nothing in it is
+    ever modified after construction: arrays are flagged non-writeable and the
+    mappings are read-only proxies, so concurrent requests need no locks.
+    Handlers compute their results into their own (per-request) arrays.
+
+    Attributes:
+        data (pandas.DataFrame): reference records, positionally indexed.
+        ids (numpy.ndarray): record ids, by position.
+        id_positions (types.MappingProxyType): record id -> position in data.
+        codes (numpy.ndarray): integer-coded feature matrix, by position.
+        vocabularies (types.MappingProxyType): column -> pandas.Index of values.
+        match_index (MatchIndex): top-k matching engine over codes (exact value
+            equality over all columns), used by closest when there is no
+            similarity index (None otherwise).
+        sources (numpy.ndarray): name of the source (file) of each record, by
+            position.
+        similarity (SimilarityIndex): top-k similarity search over the predictive
+            features, used by closest when set.
+        probabilities (numpy.ndarray): precomputed probability of default, by
+            position (None unless precompute_scores has been run).
+        predictions (numpy.ndarray): precomputed "Default"/"Pay-Off" labels, by
+            position (None unless precompute_scores has been run).
+        contributions (numpy.ndarray): precomputed per-feature contributions to
+            the log-odds of default, of shape (records, predictive features), by
+            position (None unless precompute_scores has been run and the model
+            can be explained).
+    """
+
+    data: pandas.DataFrame
+    ids: numpy.ndarray
+    id_positions: types.MappingProxyType
+    codes: numpy.ndarray
+    vocabularies: types.MappingProxyType
+    match_index: MatchIndex
+    sources: numpy.ndarray
+    similarity: SimilarityIndex = None
+    probabilities: numpy.ndarray = None
+    predictions: numpy.ndarray = None
+    contributions: numpy.ndarray = None
+
+    def lookup(self, id) -> int:
+        """
+        Position of a record in data, given its id (primary key). O(1).
+
+        Args:
+            id: record id, as entered in the app (int, float or None).
+
+        Returns:
+            (int): position of the record, or None if there is no such record.
+        """
+
+        try:
+            return self.id_positions.get(id)
+        except TypeError:  # unhashable input
+            return None
+
+    def record(self, id) -> pandas.DataFrame:
+        """
+        The reference record with a given id.
+
+        Args:
+            id: record id, as entered in the app.
+
+        Returns:
+            (pandas.DataFrame): a 1-record DataFrame, or an empty one if the id
+                does not exist.
+        """
+
+        position = self.lookup(id)
+
+        if position is None:
+            return self.data.iloc[0:0]
+
+        return self.data.iloc[[position]]
+
+    def scored(self, position: int) -> tuple:
+        """
+        Precomputed prediction for the record at a given position.
+
+        Args:
+            position (int): position of the record in data.
+
+        Returns:
+            (tuple): probability of default and predicted score, or None if scores
+                have not been precomputed.
+        """
+
+        if self.probabilities is None:
+            return None
+
+        return self.probabilities[position].item(), self.predictions[position]
+
+    def explanation(self, position: int) -> numpy.ndarray:
+        """
+        Precomputed explanation of the prediction for the record at a given
+        position.
+
+        Args:
+            position (int): position of the record in data.
+
+        Returns:
+            (numpy.ndarray): contribution of each predictive feature to the
+                log-odds of default, or None if not precomputed.
+        """
+
+        if self.contributions is None:
+            return None
+
+        return self.contributions[position]
+
+    def closest(
+        self, position: int, k: int = 5, candidates: numpy.ndarray = None
+    ) -> pandas.DataFrame:
+        """
+        The k reference records that best match the record at a given position,
+        not including the record itself: the most similar ones over the predictive
+        features if there is a similarity index, the ones sharing the most values
+        otherwise.
+
+        Args:
+            position (int): position of the query record in data.
+            k (int): number of records to return.
+            candidates (numpy.ndarray): boolean mask of the records that may be
+                returned (e.g. training records only). Defaults to all records.
+
+        Returns:
+            (pandas.DataFrame): closest records, best first (a copy), with their
+                probability of default if scores have been precomputed.
+        """
+
+        if self.similarity is not None:
+            positions, _ = self.similarity.top_k(
+                self.similarity.query(position),
+                k=k,
+                exclude=position,
+                candidates=candidates,
+            )
+        else:
+            positions, _ = self.match_index.top_k(
+                self.codes[position], k=k, exclude=position, candidates=candidates
+            )
+
+        matches = self.data.iloc[positions]
+
+        if self.probabilities is not None:
+            matches = matches.assign(
+                probability_of_default=self.probabilities[positions]
+            )
+
+        return matches
+
+
+def build_reference_data(
+    sources, mode: str = "dense", metric: str = "gower"
+) -> ReferenceData:
+    """
+    A function to build the read-only reference data store.
+
+    Args:
+        sources (dict | pandas.DataFrame): reference records to be stored, as a
+            mapping of source name (e.g. file name) -> pandas.DataFrame, or as
+            one DataFrame with attrs["sources"] mapping each source name to its
+            number of consecutive records (as returned by read_json_lines),
+            which is stored as is rather than copied.
+        mode (str): matching mode, "dense" or "inverted" (see MatchIndex), when
+            metric is None.
+        metric (str): similarity metric of the closest records (see
+            similarity.METRICS), or None to match exact values over all columns.
+
+    Raises:
+        ValueError: if the same id appears more than once across sources.
+
+    Returns:
+        (ReferenceData): the reference data store.
+    """
+
+    if isinstance(sources, pandas.DataFrame):
+        data = sources
+        lengths = data.attrs["sources"]
+    else:
+        data = pandas.concat(list(sources.values()), ignore_index=True)
+        lengths = {name: len(frame) for name, frame in sources.items()}
+
+    # "id" is the primary key: flag duplicates at load rather than letting a
+    # lookup silently return several records
+    source_names = numpy.repeat(
+        numpy.array(list(lengths.keys()), dtype=object), list(lengths.values())
+    )
+    source_names.setflags(write=False)
+
+    duplicated = data["id"].duplicated(keep=False).to_numpy()
+    if duplicated.any():
+        details = (
+            pandas.Series(source_names[duplicated], index=data["id"][duplicated])
+            .groupby(level=0)
+            .agg(", ".join)
+        )
+        raise ValueError(
+            "Duplicate record ids in reference data: {}".format(
+                "; ".join("{} ({})".format(id, names) for id, names in details.items())
+            )
+        )
+
+    codes, vocabularies = encode_features(data)
+    codes.setflags(write=False)
+
+    ids = data["id"].to_numpy(copy=True)
+    ids.setflags(write=False)
+
+    return ReferenceData(
+        data=data,
+        ids=ids,
+        id_positions=types.MappingProxyType(
+            {id: position for position, id in enumerate(ids.tolist())}
+        ),
+        codes=codes,
+        vocabularies=types.MappingProxyType(vocabularies),
+        # Only the index closest uses is built
+        match_index=MatchIndex(codes, mode=mode) if metric is None else None,
+        sources=source_names,
+        similarity=(
+            SimilarityIndex(data, predictive_features, metric=metric)
+            if metric is not None
+            else None
+        ),
+    )
+
+
+def precompute_scores(reference_data: ReferenceData) -> ReferenceData:
+    """
+    A function to score and explain every reference record in one batch, at
+    startup. The model must have been loaded (german_credit.init).
+
+    Args:
+        reference_data (ReferenceData): the reference data store.
+
+    Returns:
+        (ReferenceData): a copy of the store, with probabilities, predictions and
+            contributions.
+    """
+
+    start = time.perf_counter()
+
+    probabilities, predictions = score_batch(reference_data.data, observe=False)
+    probabilities.setflags(write=False)
+    predictions.setflags(write=False)
+
+    contributions = explain_batch(reference_data.data)
+    if contributions is not None:
+        contributions.setflags(write=False)
+
+    event_log.emit(
+        "reference_scores_precomputed",
+        records=len(probabilities),
+        seconds=time.perf_counter() - start,
+    )
+
+    return reference_data._replace(
+        probabilities=probabilities,
+        predictions=predictions,
+        contributions=contributions,
+    )
@@ -0,0 +1,488 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy
+
+from . import german_credit
+from .events import event_log
+from .metrics import registry as metrics_registry
+from .workers import BackgroundWorker
+
+# Optional file of a registry directory selecting the active and shadow versions
+MANIFEST_NAME = "registry.json"
+
+# Extension of the model artifacts of a registry directory: <version>.pickle
+ARTIFACT_EXTENSION = ".pickle"
+
+shadow_difference = metrics_registry.histogram(
+    "model_shadow_probability_difference",
+    "Absolute difference between the probabilities of default of the shadow "
+    "(challenger) model and of the active model.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5),
+)
+
+
+class ShadowScorer(BackgroundWorker):
+    """
+    A challenger model scoring a sample of the traffic, off the request path.
+
+    Installed as german_credit.shadow_hook: for a fraction of the scoring calls,
+    the records and the active model's probabilities are queued. A background
+    thread scores them with the challenger and logs the comparison (event log and
+    model_shadow_probability_difference histogram). When the queue is full,
+    samples are dropped rather than slowing requests down.
+
+    Args:
+        model (german_credit.ScoringModel): the challenger model.
+        fraction (float): fraction of the scoring calls sent to the challenger.
+        max_queue_depth (int): largest number of queued scoring calls.
+    """
+
+    def __init__(
+        self,
+        model: german_credit.ScoringModel,
+        fraction: float,
+        max_queue_depth: int = 1000,
+    ):
+        super().__init__(max_queue_depth)
+        self.model = model
+        self.fraction = fraction
+
+        self._lock = threading.Lock()
+
+        self.sampled = 0
+        self.dropped = 0
+        self.records = 0
+        self.disagreements = 0
+        self.failures = 0
+
+    def __call__(self, columns, probabilities: numpy.ndarray) -> None:
+        if random.random() >= self.fraction:
+            return
+
+        active = german_credit.active_model
+
+        try:
+            self._ensure_started().put_nowait(
+                (columns, probabilities, active.version if active else None)
+            )
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+
+        with self._lock:
+            self.sampled += 1
+
+    def _run(self, pending: queue.Queue) -> None:
+        while True:
+            columns, probabilities, active_version = pending.get()
+            try:
+                self._compare(columns, probabilities, active_version)
+            except Exception as error:
+                with self._lock:
+                    self.failures += 1
+                event_log.emit(
+                    "shadow_failure", shadow=self.model.version, error=repr(error)
+                )
+
+    def _compare(self, columns, probabilities, active_version) -> None:
+        if isinstance(columns, list):
+            columns = {
+                name: [record[name] for record in columns]
+                for name in german_credit.predictive_features
+            }
+
+        challenger = numpy.round(self.model.predict_proba(columns)[:, 1], 3)
+        differences = numpy.abs(challenger - probabilities)
+        disagreements = int(((challenger > 0.5) != (probabilities > 0.5)).sum())
+
+        for difference in differences:
+            shadow_difference.observe(difference)
+
+        with self._lock:
+            self.records += len(differences)
+            self.disagreements += disagreements
+
+        event_log.emit(
+            "shadow_comparison",
+            active=active_version,
+            shadow=self.model.version,
+            records=len(differences),
+            mean_abs_difference=float(differences.mean()),
+            max_abs_difference=float(differences.max()),
+            disagreements=disagreements,
+        )
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            (dict): challenger version, sampled fraction, sampled and dropped
+                scoring calls, compared records, label disagreements and failures.
+        """
+
+        with self._lock:
+            return {
+                "version": self.model.version,
+                "fraction": self.fraction,
+                "sampled": self.sampled,
+                "dropped": self.dropped,
+                "records": self.records,
+                "disagreements": self.disagreements,
+                "failures": self.failures,
+            }
+
+
+class ModelRegistry(BackgroundWorker):
+    """
+    A directory of versioned model artifacts, <version>.pickle, with hot reload.
+
+    The active version, and optionally a shadow (challenger) version scoring a
+    fraction of the traffic, are selected by a registry.json file:
+
+        {"active": "2023-01", "shadow": "2023-02", "shadow_fraction": 0.05}
+
+    Without it (or without "active"), the last version by name is active.
+
+    A version is validated against the reference data before it is activated:
+    the compiled kernel must agree with sklearn, probabilities must be valid and,
+    if min_accuracy is set, the accuracy on the reference labels high enough.
+    Activation swaps german_credit.active_model in a single assignment, then
+    calls the listeners (e.g. to refresh precomputed scores). A version failing
+    validation is reported and the current model stays active.
+
+    Each process polls the directory every poll_interval seconds once
+    start_polling has been called, and reloads when a file changes.
+
+    Args:
+        directory (str): directory of the artifacts.
+        reference_data (pandas.DataFrame): records used for validation, with a
+            "status" column ("Default" or "Paid-Off").
+        min_accuracy (float): smallest accuracy on the reference data, or None.
+        tolerance (float): largest difference allowed between the compiled
+            kernel and sklearn.
+        shadow_fraction (float): fraction of the traffic scored by the shadow
+            version, unless set in registry.json.
+        poll_interval (float): seconds between two checks of the directory.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        reference_data=None,
+        min_accuracy: float = None,
+        tolerance: float = 1e-9,
+        shadow_fraction: float = 0.0,
+        poll_interval: float = 10.0,
+    ):
+        super().__init__()
+        self.directory = directory
+        self.reference_data = reference_data
+        self.min_accuracy = min_accuracy
+        self.tolerance = tolerance
+        self.shadow_fraction = shadow_fraction
+        self.poll_interval = poll_interval
+
+        self.listeners = []
+        self.active = None
+        self.shadow = None
+        self.reports = {}
+
+        # Size and mtime of each loaded artifact, to detect replaced files
+        self._artifacts = {}
+        self._lock = threading.RLock()
+        self._signature = None
+
+    def versions(self) -> list:
+        """
+        Returns:
+            (list): names of the available versions, sorted.
+        """
+
+        return sorted(
+            name[: -len(ARTIFACT_EXTENSION)]
+            for name in os.listdir(self.directory)
+            if name.endswith(ARTIFACT_EXTENSION)
+        )
+
+    def manifest(self) -> dict:
+        """
+        Returns:
+            (dict): contents of registry.json, empty if there is none.
+
+        Raises:
+            ValueError: if registry.json is not a valid JSON object.
+        """
+
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME)) as manifest:
+                manifest = json.load(manifest)
+        except FileNotFoundError:
+            return {}
+
+        if not isinstance(manifest, dict):
+            raise ValueError("{} must hold a JSON object".format(MANIFEST_NAME))
+
+        return manifest
+
+    def load(self, version: str) -> german_credit.ScoringModel:
+        """
+        Args:
+            version (str): name of the version.
+
+        Returns:
+            (german_credit.ScoringModel): the loaded model, not yet validated.
+        """
+
+        if version not in self.versions():
+            raise ValueError("Unknown model version: {}".format(version))
+
+        return german_credit.ScoringModel(
+            os.path.join(self.directory, version + ARTIFACT_EXTENSION),
+            version=version,
+        )
+
+    def validate(self, model: german_credit.ScoringModel) -> dict:
+        """
+        Check a model against the reference data.
+
+        Args:
+            model (german_credit.ScoringModel): the model.
+
+        Raises:
+            ValueError: if the compiled kernel disagrees with sklearn, or if the
+                model cannot score the reference data, returns invalid
+                probabilities or is not accurate enough.
+
+        Returns:
+            (dict): number of records, accuracy on the reference labels and
+                largest difference between the compiled kernel and sklearn.
+        """
+
+        data = self.reference_data
+        if data is None or len(data) == 0:
+            return {"records": 0}
+
+        difference = model.validate(data, self.tolerance)
+        if difference > self.tolerance:
+            raise ValueError(
+                "compiled kernel differs from sklearn by {:g}".format(difference)
+            )
+
+        try:
+            probabilities = model.predict_proba(data)
+        except Exception as error:
+            raise ValueError("cannot score the reference data: {!r}".format(error))
+
+        if probabilities.shape != (len(data), 2):
+            raise ValueError(
+                "predict_proba returned shape {}".format(probabilities.shape)
+            )
+        if (
+            not numpy.isfinite(probabilities).all()
+            or ((probabilities < 0) | (probabilities > 1)).any()
+        ):
+            raise ValueError("predict_proba returned invalid probabilities")
+
+        defaults = (data["status"] == "Default").to_numpy()
+        accuracy = float(((probabilities[:, 1] > 0.5) == defaults).mean())
+
+        if self.min_accuracy is not None and accuracy < self.min_accuracy:
+            raise ValueError(
+                "accuracy {:.3f} below the minimum {:.3f}".format(
+                    accuracy, self.min_accuracy
+                )
+            )
+
+        return {
+            "records": len(data),
+            "accuracy": accuracy,
+            "kernel_difference": difference,
+        }
+
+    def _load_valid(self, version: str) -> german_credit.ScoringModel:
+        stat = self._artifact_stat(version) if version in self.versions() else None
+        model = self.load(version)
+        report = self.validate(model)
+        self.reports[version] = dict(report, sha256=model.digest)
+        self._artifacts[version] = stat
+        return model
+
+    def activate(self, version: str) -> None:
+        """
+        Load, validate and activate a version.
+
+        Args:
+            version (str): name of the version.
+
+        Raises:
+            ValueError: if the version is unknown or fails validation.
+        """
+
+        with self._lock:
+            model = self._load_valid(version)
+
+            german_credit.activate(model)
+            self.active = model
+
+            event_log.emit(
+                "model_activated",
+                version=version,
+                sha256=model.digest,
+                report=self.reports[version],
+            )
+
+            for listener in self.listeners:
+                listener(model)
+
+    def set_shadow(self, version: str, fraction: float) -> None:
+        """
+        Load and validate a version, then score a fraction of the traffic with
+        it. The shadow is removed if version is None or fraction is 0.
+
+        Args:
+            version (str): name of the version, or None.
+            fraction (float): fraction of the scoring calls, from 0 to 1.
+
+        Raises:
+            ValueError: if the version is unknown or fails validation.
+        """
+
+        with self._lock:
+            if version is None or fraction <= 0:
+                german_credit.shadow_hook = self.shadow = None
+                return
+
+            self.shadow = ShadowScorer(self._load_valid(version), fraction)
+            german_credit.shadow_hook = self.shadow
+
+            event_log.emit("model_shadowed", version=version, fraction=fraction)
+
+    def refresh(self) -> None:
+        """
+        Activate the versions selected by the directory (see the class
+        description), reloading those whose artifact changed.
+
+        Raises:
+            ValueError: if the selected version cannot be activated.
+        """
+
+        with self._lock:
+            self._signature = self._directory_signature()
+
+            manifest = self.manifest()
+            versions = self.versions()
+            if not versions:
+                raise ValueError("No model artifact in {}".format(self.directory))
+
+            # Shadow first, so that scoring after the activation (e.g. by the
+            # listeners) is not compared against a stale challenger
+            shadow = manifest.get("shadow")
+            fraction = float(manifest.get("shadow_fraction", self.shadow_fraction))
+            if shadow is None or fraction <= 0:
+                if self.shadow is not None:
+                    self.set_shadow(None, 0.0)
+            elif (
+                self.shadow is None
+                or self.shadow.fraction != fraction
+                or not self._is_current(self.shadow.model, shadow)
+            ):
+                self.set_shadow(shadow, fraction)
+
+            active = manifest.get("active") or versions[-1]
+            if not self._is_current(self.active, active):
+                self.activate(active)
+
+    def _is_current(self, model, version: str) -> bool:
+        # Whether a loaded model is that version, with an unchanged artifact
+        if model is None or model.version != version:
+            return False
+
+        try:
+            return self._artifacts.get(version) == self._artifact_stat(version)
+        except OSError:
+            return True
+
+    def _artifact_stat(self, version: str) -> tuple:
+        stat = os.stat(os.path.join(self.directory, version + ARTIFACT_EXTENSION))
+        return stat.st_size, stat.st_mtime_ns
+
+    def _directory_signature(self) -> tuple:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name == MANIFEST_NAME or entry.name.endswith(ARTIFACT_EXTENSION):
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(entries))
+
+    def start_polling(self) -> None:
+        """
+        Start checking the directory for changes in this process (once per
+        process; cheap to call on every request).
+        """
+
+        self._ensure_started()
+
+    def _start(self, pending) -> None:
+        # Nothing is queued: the thread polls the directory
+        threading.Thread(target=self._poll, daemon=True).start()
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+
+            try:
+                if self._directory_signature() == self._signature:
+                    continue
+                self.refresh()
+            except Exception as error:
+                # Keep serving the current model (unreadable, invalid or unsupported
+                # artifact)
+                event_log.emit("model_reload_failure", error=str(error))
+
+    def status(self) -> dict:
+        """
+        Returns:
+            (dict): available versions, active version, shadow version and its
+                comparison counters, validation reports.
+        """
+
+        with self._lock:
+            return {
+                "versions": self.versions(),
+                "active": self.active.version if self.active else None,
+                "shadow": self.shadow.stats() if self.shadow else None,
+                "validation": self.reports,
+            }
+
+
+def create_model_registry(reference_data=None) -> ModelRegistry:
+    """
+    A function to create the model registry configured by environment variables:
+    MODEL_REGISTRY_DIR (directory of versioned artifacts; no registry if unset),
+    MODEL_REGISTRY_POLL_SECONDS, MODEL_SHADOW_FRACTION and MODEL_MIN_ACCURACY.
+
+    Args:
+        reference_data (pandas.DataFrame): records used for validation.
+
+    Returns:
+        (ModelRegistry): the registry, or None.
+    """
+
+    directory = os.environ.get("MODEL_REGISTRY_DIR")
+    if not directory:
+        return None
+
+    min_accuracy = os.environ.get("MODEL_MIN_ACCURACY")
+
+    return ModelRegistry(
+        directory,
+        reference_data=reference_data,
+        min_accuracy=float(min_accuracy) if min_accuracy else None,
+        shadow_fraction=float(os.environ.get("MODEL_SHADOW_FRACTION", 0)),
+        poll_interval=float(os.environ.get("MODEL_REGISTRY_POLL_SECONDS", 10)),
+    )
@@ -0,0 +1,219 @@
+import threading
+
+import numpy
+
+# Segments compared: each record is counted in one segment per dimension. The
+# last dimension crosses the two protected attributes
+SEGMENT_DIMENSIONS = ("gender", "age_over_forty", "gender_age_over_forty")
+
+# Number of equal-width bins of the probability of default histograms
+HISTOGRAM_BINS = 10
+
+
+def segment_values(gender, age_over_forty) -> tuple:
+    """
+    A function to get the segment of a record in each dimension.
+
+    Args:
+        gender: value of the gender field (None if missing).
+        age_over_forty: value of the age_over_forty field (None if missing).
+
+    Returns:
+        (tuple): segment names, in SEGMENT_DIMENSIONS order.
+    """
+
+    gender = "unknown" if gender is None else str(gender)
+    age_over_forty = "unknown" if age_over_forty is None else str(age_over_forty)
+
+    return gender, age_over_forty, "{}/{}".format(gender, age_over_forty)
+
+
+class SegmentStats:
+    """
+    Running statistics of the predictions per segment (see SEGMENT_DIMENSIONS):
+    number of records, predicted defaults, observed defaults (when the true status
+    is known), sum of probabilities and a histogram of probabilities.
+
+    These are sufficient statistics: a scored record updates a few counters of
+    its segments, in O(1), and the rates and ratios are derived when the summary
+    is requested, without rescanning any records.
+    """
+
+    def __init__(self):
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def _counters(self, dimension: str, segment: str) -> list:
+        # Records, predicted defaults, labelled records, observed defaults, sum of
+        # probabilities, histogram
+        counters = self._segments.get((dimension, segment))
+        if counters is None:
+            counters = self._segments[(dimension, segment)] = [
+                0,
+                0,
+                0,
+                0,
+                0.0,
+                [0] * HISTOGRAM_BINS,
+            ]
+        return counters
+
+    def update(
+        self,
+        gender,
+        age_over_forty,
+        probability: float,
+        prediction: str,
+        status: str = None,
+    ) -> None:
+        """
+        Add a scored record to the statistics of its segments.
+
+        Args:
+            gender: gender of the applicant (None if unknown).
+            age_over_forty: whether the applicant is over forty (None if unknown).
+            probability (float): predicted probability of default.
+            prediction (str): "Default" or "Pay-Off".
+            status (str): observed outcome, "Default" or "Paid-Off" (None if
+                unknown).
+        """
+
+        self.update_batch(
+            [gender], [age_over_forty], [probability], [prediction], [status]
+        )
+
+    def update_batch(
+        self,
+        genders,
+        ages_over_forty,
+        probabilities,
+        predictions,
+        statuses=None,
+    ) -> None:
+        """
+        Add many scored records to the statistics of their segments.
+
+        Args:
+            genders: gender of each applicant (None if unknown).
+            ages_over_forty: whether each applicant is over forty (None if unknown).
+            probabilities: predicted probability of default of each record.
+            predictions: "Default" or "Pay-Off", for each record.
+            statuses: observed outcome of each record, "Default" or "Paid-Off"
+                (None if unknown). Defaults to unknown outcomes.
+        """
+
+        probabilities = numpy.asarray(probabilities, dtype=float)
+        if statuses is None:
+            statuses = [None] * len(probabilities)
+
+        bins = numpy.minimum(
+            (probabilities * HISTOGRAM_BINS).astype(int), HISTOGRAM_BINS - 1
+        ).tolist()
+
+        with self._lock:
+            for gender, age_over_forty, probability, prediction, status, bin in zip(
+                genders,
+                ages_over_forty,
+                probabilities.tolist(),
+                predictions,
+                statuses,
+                bins,
+            ):
+                for dimension, segment in zip(
+                    SEGMENT_DIMENSIONS, segment_values(gender, age_over_forty)
+                ):
+                    counters = self._counters(dimension, segment)
+                    counters[0] += 1
+                    counters[1] += prediction == "Default"
+                    if status is not None:
+                        counters[2] += 1
+                        counters[3] += status == "Default"
+                    counters[4] += probability
+                    counters[5][bin] += 1
+
+    def summary(self) -> list:
+        """
+        Returns:
+            (list): one dict per segment, by dimension then segment: records,
+                predicted and observed default rates, mean probability of default,
+                approval (Pay-Off) rate, ratio of the approval rate to the highest
+                one in the dimension, and histogram of probabilities.
+        """
+
+        with self._lock:
+            segments = sorted(
+                (key, list(counters[:5]) + [list(counters[5])])
+                for key, counters in self._segments.items()
+            )
+
+        rows = []
+        for (dimension, segment), counters in segments:
+            records, defaults, labelled, observed_defaults, total, histogram = counters
+            rows.append(
+                {
+                    "dimension": dimension,
+                    "segment": segment,
+                    "records": records,
+                    "predicted_default_rate": defaults / records,
+                    "observed_default_rate": (
+                        observed_defaults / labelled if labelled else None
+                    ),
+                    "mean_probability_of_default": total / records,
+                    "approval_rate": 1.0 - defaults / records,
+                    "histogram": histogram,
+                }
+            )
+
+        # Disparate impact: approval rate relative to the best-treated segment
+        highest = {}
+        for row in rows:
+            highest[row["dimension"]] = max(
+                highest.get(row["dimension"], 0.0), row["approval_rate"]
+            )
+        for row in rows:
+            best = highest[row["dimension"]]
+            row["approval_rate_ratio"] = row["approval_rate"] / best if best else None
+
+        return rows
+
+
+def reference_segment_stats(reference_data) -> SegmentStats:
+    """
+    A function to compute the segment statistics of the reference set, from its
+    precomputed scores (see reference.precompute_scores).
+
+    Args:
+        reference_data (ReferenceData): the reference data store.
+
+    Returns:
+        (SegmentStats): the statistics, or None if scores have not been
+            precomputed.
+    """
+
+    if reference_data.probabilities is None:
+        return None
+
+    data = reference_data.data
+    stats = SegmentStats()
+    stats.update_batch(
+        data["gender"].tolist(),
+        data["age_over_forty"].tolist(),
+        reference_data.probabilities,
+        reference_data.predictions,
+        data["status"].tolist() if "status" in data else None,
+    )
+
+    return stats
+
+
+def histogram_edges() -> list:
+    """
+    Returns:
+        (list): lower edges of the histogram bins.
+    """
+
+    return [i / HISTOGRAM_BINS for i in range(HISTOGRAM_BINS)]
+
+
+# Predictions served by the scoring API in this process, per segment
+traffic_stats = SegmentStats()
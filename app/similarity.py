@@ -0,0 +1,246 @@
+import numpy
+import pandas
+
+
+def gower(mismatches, differences, categorical_weights, numeric_weights):
+    """
+    Gower distance: weighted mean of the per-feature dissimilarities, 0 or 1 for a
+    categorical feature and the range-scaled absolute difference for a numerical
+    one.
+
+    Args:
+        mismatches (numpy.ndarray): whether each categorical feature differs from
+            the query, of shape (records, categorical features).
+        differences (numpy.ndarray): range-scaled absolute differences with the
+            query, of shape (records, numerical features).
+        categorical_weights (numpy.ndarray): weight of each categorical feature.
+        numeric_weights (numpy.ndarray): weight of each numerical feature.
+
+    Returns:
+        (numpy.ndarray): distance of each record to the query, from 0 to 1.
+    """
+
+    total = categorical_weights.sum() + numeric_weights.sum()
+
+    return (mismatches @ categorical_weights + differences @ numeric_weights) / total
+
+
+def hamming(mismatches, differences, categorical_weights, numeric_weights):
+    """
+    Weighted Hamming distance: weighted share of the features that differ from the
+    query. Numerical values within NUMERIC_TOLERANCE of the query's (as a fraction
+    of the feature's range) count as equal. Arguments as for gower.
+    """
+
+    total = categorical_weights.sum() + numeric_weights.sum()
+    different = (differences > NUMERIC_TOLERANCE).astype(differences.dtype)
+
+    return (mismatches @ categorical_weights + different @ numeric_weights) / total
+
+
+# Numerical differences below this fraction of the range are ignored by hamming
+NUMERIC_TOLERANCE = 0.05
+
+# Distance functions available by name; a callable with the same signature can be
+# passed to SimilarityIndex instead
+METRICS = {"gower": gower, "hamming": hamming}
+
+
+class SimilarityIndex:
+    """
+    Top-k similarity search over mixed categorical and numerical features.
+
+    Categorical features are integer-coded and numerical ones scaled to [0, 1] by
+    their range once, at construction. A query is compared with the reference
+    records one block of chunk_size rows at a time, keeping only the best k of
+    each block, so memory stays bounded whatever the number of records. Ties are
+    broken by position in the reference set (earlier records first).
+
+    Args:
+        data (pandas.DataFrame): reference records.
+        features (list): columns compared (e.g. the model's predictive features).
+            Numeric columns are compared as numbers, others as categories.
+        metric: name of a distance in METRICS, or a callable with their signature.
+        weights (dict): feature -> weight. Defaults to 1 for every feature.
+        chunk_size (int): number of records compared at a time.
+    """
+
+    def __init__(
+        self,
+        data: pandas.DataFrame,
+        features: list,
+        metric="gower",
+        weights: dict = None,
+        chunk_size: int = 65536,
+    ):
+        if not callable(metric):
+            if metric not in METRICS:
+                raise ValueError("Unknown similarity metric: {}".format(metric))
+            metric = METRICS[metric]
+
+        self.metric = metric
+        self.chunk_size = chunk_size
+        self.n_records = len(data)
+
+        self.numeric_features = [
+            name
+            for name in features
+            if pandas.api.types.is_numeric_dtype(data[name])
+            and not pandas.api.types.is_bool_dtype(data[name])
+        ]
+        self.categorical_features = [
+            name for name in features if name not in self.numeric_features
+        ]
+
+        weights = weights or {}
+        self.categorical_weights = numpy.array(
+            [weights.get(name, 1.0) for name in self.categorical_features],
+            dtype=numpy.float32,
+        )
+        self.numeric_weights = numpy.array(
+            [weights.get(name, 1.0) for name in self.numeric_features],
+            dtype=numpy.float32,
+        )
+
+        # Categories: codes by column, missing values as -1
+        self.codes = numpy.empty(
+            (self.n_records, len(self.categorical_features)), dtype=numpy.int32
+        )
+        self.vocabularies = {}
+        for j, name in enumerate(self.categorical_features):
+            self.codes[:, j], self.vocabularies[name] = pandas.factorize(data[name])
+
+        # Numbers: scaled to [0, 1] by the range of each column
+        values = data[self.numeric_features].to_numpy(dtype=numpy.float64)
+        if self.n_records:
+            self.minimums = numpy.nanmin(values, axis=0)
+            self.ranges = numpy.nanmax(values, axis=0) - self.minimums
+        else:
+            self.minimums = numpy.zeros(len(self.numeric_features))
+            self.ranges = numpy.ones(len(self.numeric_features))
+        # Constant (or empty) columns: any difference counts fully
+        self.ranges[~(self.ranges > 0)] = 1.0
+        self.scaled = ((values - self.minimums) / self.ranges).astype(numpy.float32)
+
+        for array in (self.codes, self.scaled):
+            array.setflags(write=False)
+
+    def encode(self, record: dict) -> tuple:
+        """
+        A function to encode a record as the reference records are.
+
+        Args:
+            record (dict): record containing the compared features.
+
+        Returns:
+            (tuple): category codes (-1 for unseen values) and scaled numbers.
+        """
+
+        codes = numpy.array(
+            [
+                self.vocabularies[name].get_indexer([record[name]])[0]
+                for name in self.categorical_features
+            ],
+            dtype=numpy.int32,
+        )
+        values = numpy.array(
+            [record[name] for name in self.numeric_features], dtype=numpy.float64
+        )
+
+        return codes, ((values - self.minimums) / self.ranges).astype(numpy.float32)
+
+    def query(self, position: int) -> tuple:
+        """
+        Args:
+            position (int): position of a reference record.
+
+        Returns:
+            (tuple): encoded record, as returned by encode.
+        """
+
+        return self.codes[position], self.scaled[position]
+
+    def distances(self, query: tuple, start: int = 0, stop: int = None):
+        """
+        Distances from a query to a block of reference records.
+
+        Args:
+            query (tuple): encoded query, as returned by encode or query.
+            start (int): position of the first record of the block.
+            stop (int): position after the last record of the block.
+
+        Returns:
+            (numpy.ndarray): distances, one per record of the block.
+        """
+
+        codes, scaled = query
+        # Unseen or missing query values differ from everything
+        codes = numpy.where(codes < 0, -2, codes)
+
+        mismatches = (self.codes[start:stop] != codes).astype(numpy.float32)
+        differences = numpy.abs(self.scaled[start:stop] - scaled)
+        # Missing numbers are as far as possible
+        differences[numpy.isnan(differences)] = 1.0
+
+        return self.metric(
+            mismatches, differences, self.categorical_weights, self.numeric_weights
+        )
+
+    def top_k(
+        self, query: tuple, k: int = 5, exclude: int = None, candidates=None
+    ) -> tuple:
+        """
+        Positions of the k reference records closest to a query.
+
+        Args:
+            query (tuple): encoded query, as returned by encode or query.
+            k (int): number of records to return.
+            exclude (int): position of a record to leave out (e.g. the query itself).
+            candidates (numpy.ndarray): boolean mask of the records that may be
+                returned (e.g. training records only). Defaults to all records.
+
+        Returns:
+            (tuple): positions (numpy.ndarray) of the closest records, closest
+                first, and their distances.
+        """
+
+        positions = numpy.empty(0, dtype=numpy.intp)
+        distances = numpy.empty(0, dtype=numpy.float32)
+
+        if k <= 0:
+            return positions, distances
+
+        for start in range(0, self.n_records, self.chunk_size):
+            stop = min(start + self.chunk_size, self.n_records)
+            block = self.distances(query, start, stop)
+
+            # Records left out are pushed beyond any distance, then dropped
+            if candidates is not None:
+                block[~candidates[start:stop]] = numpy.inf
+            if exclude is not None and start <= exclude < stop:
+                block[exclude - start] = numpy.inf
+
+            best = _smallest(block, k)
+            positions = numpy.concatenate((positions, best + start))
+            distances = numpy.concatenate((distances, block[best]))
+
+            # Best k so far; blocks are visited in order, so ties stay by position
+            order = numpy.lexsort((positions, distances))[:k]
+            positions, distances = positions[order], distances[order]
+
+        kept = numpy.isfinite(distances)
+
+        return positions[kept], distances[kept]
+
+
+def _smallest(values: numpy.ndarray, k: int) -> numpy.ndarray:
+    # Positions of the k smallest values; values tied with the k-th smallest are
+    # taken by position rather than in (arbitrary) partition order
+    if k >= len(values):
+        return numpy.arange(len(values))
+
+    threshold = numpy.partition(values, k - 1)[k - 1]
+    smaller = numpy.flatnonzero(values < threshold)
+    tied = numpy.flatnonzero(values == threshold)[: k - len(smaller)]
+
+    return numpy.concatenate((smaller, tied))
@@ -0,0 +1,102 @@
+import numpy
+
+from . import german_credit
+
+# Largest number of values swept for a numerical feature (spread over its range)
+MAX_NUMERIC_POINTS = 100
+
+# Largest number of features swept together
+MAX_SWEPT_FEATURES = 2
+
+
+def feature_vocabularies(fallback: dict) -> dict:
+    """
+    A function to get the values known to the active model for each predictive
+    feature: the categories of its one-hot encoder (the training vocabulary) when
+    it has been compiled, the values of the fallback records otherwise.
+
+    Args:
+        fallback (dict): column -> values (e.g. ReferenceData.vocabularies).
+
+    Returns:
+        (dict): predictive feature -> sorted numpy.ndarray of values.
+    """
+
+    kernel = german_credit.active_model.kernel
+
+    if kernel is not None:
+        return dict(zip(kernel.features, kernel.categories))
+
+    return {
+        name: numpy.sort(numpy.asarray(fallback[name]))
+        for name in german_credit.predictive_features
+    }
+
+
+def sweep_values(
+    vocabulary, numeric: bool, max_points: int = MAX_NUMERIC_POINTS
+) -> numpy.ndarray:
+    """
+    A function to choose the values swept for a feature: every category of a
+    categorical feature, and at most max_points values spread over the range of a
+    numerical one (always including its smallest and largest values).
+
+    Args:
+        vocabulary: sorted values known for the feature.
+        numeric (bool): whether the feature is numerical.
+        max_points (int): largest number of values for a numerical feature.
+
+    Returns:
+        (numpy.ndarray): values to sweep, sorted.
+    """
+
+    values = numpy.asarray(vocabulary)
+
+    if numeric and len(values) > max_points:
+        positions = numpy.linspace(0, len(values) - 1, max_points).round()
+        values = values[numpy.unique(positions.astype(int))]
+
+    return values
+
+
+def sweep(record: dict, grid: dict) -> numpy.ndarray:
+    """
+    A function to score every combination of values of one or two features of a
+    record, the other features keeping the record's values. The whole grid is
+    scored in one batched model call.
+
+    Args:
+        record (dict): record to be varied, containing predictive features.
+        grid (dict): swept feature -> values (1 or 2 features, in axis order).
+
+    Raises:
+        ValueError: if no feature or more than MAX_SWEPT_FEATURES are swept.
+
+    Returns:
+        (numpy.ndarray): unrounded probabilities of default, of shape
+            (len(values) of each swept feature).
+    """
+
+    if not 0 < len(grid) <= MAX_SWEPT_FEATURES:
+        raise ValueError(
+            "Between 1 and {} features can be swept".format(MAX_SWEPT_FEATURES)
+        )
+
+    shape = tuple(len(values) for values in grid.values())
+    size = int(numpy.prod(shape))
+
+    # Swept features: their values in every combination (first feature varying
+    # slowest); other features: the record's value, repeated
+    axes = numpy.meshgrid(*grid.values(), indexing="ij")
+    columns = {name: axis.ravel() for name, axis in zip(grid, axes)}
+
+    for name in german_credit.predictive_features:
+        if name not in columns:
+            value = record[name]
+            if isinstance(value, numpy.generic):
+                value = value.item()
+            columns[name] = numpy.full(
+                size, value, dtype=object if isinstance(value, str) else None
+            )
+
+    return german_credit.fast_predict_proba(columns)[:, 1].reshape(shape)
@@ -0,0 +1,45 @@
+import os
+import queue
+import threading
+
+
+class BackgroundWorker:
+    """
+    Base class of the objects served by a background thread of their own process.
+
+    The thread is started lazily, on first use, and again in each forked worker
+    process: a thread started in the gunicorn master does not survive the fork.
+    _ensure_started is cheap to call on every request. By default the thread runs
+    _run, which subclasses implement, on a queue created for this process;
+    subclasses can override _start to serve the queue differently.
+
+    Args:
+        max_queue_depth (int): largest number of queued items (0 for no limit).
+    """
+
+    def __init__(self, max_queue_depth: int = 0):
+        self.max_queue_depth = max_queue_depth
+
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def _ensure_started(self) -> queue.Queue:
+        # Double-checked, so that the lock is only taken until the thread runs
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue_depth)
+                    self._start(self._queue)
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _started(self) -> bool:
+        # Whether the thread runs in this process
+        return self._pid == os.getpid()
+
+    def _start(self, pending: queue.Queue) -> None:
+        threading.Thread(target=self._run, args=(pending,), daemon=True).start()
+
+    def _run(self, pending: queue.Queue) -> None:
+        raise NotImplementedError
@@ -0,0 +1,19 @@
+def create_server():
+    """
+    An app factory for production WSGI servers.
+
+    create_app loads the model and the reference data, sets the layout and warms
+    up Dash. With gunicorn's preload_app (see gunicorn.conf.py) this happens once,
+    in the master process, before workers are forked, so all workers share that
+    memory copy-on-write.
+
+    Usage:
+        gunicorn -c gunicorn.conf.py "app.wsgi:create_server()"
+
+    Returns:
+        (flask.Flask): the Flask server underlying the Dash app.
+    """
+
+    from .app import create_app
+
+    return create_app().server
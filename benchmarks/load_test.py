@@ -0,0 +1,117 @@
+"""
+Load test of the /api/v1/score endpoint: p50/p99 latency and throughput.
+
+Start the app with gunicorn first, e.g.
+
+    GUNICORN_BIND=127.0.0.1:8080 gunicorn -c gunicorn.conf.py "app.wsgi:create_server()"
+
+then run from the repository root:
+
+    python -m benchmarks.load_test --url http://127.0.0.1:8080 --batch-size 100
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "app", "data")
+
+
+def load_payloads(batch_size: int) -> list:
+    # Request bodies cycling through the bundled records
+    with open(os.path.join(DATA_DIR, "training_data.json")) as source:
+        records = [json.loads(line) for line in source]
+
+    if batch_size == 1:
+        return [json.dumps(record).encode() for record in records]
+
+    return [
+        json.dumps(records[start : start + batch_size]).encode()
+        for start in range(0, len(records) - batch_size + 1, batch_size)
+    ]
+
+
+def worker(url, payloads, deadline, latencies, failures):
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80)
+
+    for body in itertools.cycle(payloads):
+        if time.perf_counter() >= deadline:
+            break
+
+        start = time.perf_counter()
+        try:
+            connection.request(
+                "POST",
+                "/api/v1/score",
+                body=body,
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            failures.append(1)
+            connection.close()
+            connection = http.client.HTTPConnection(url.hostname, url.port or 80)
+            continue
+
+        if response.status != 200:
+            failures.append(response.status)
+        else:
+            latencies.append(time.perf_counter() - start)
+
+    connection.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    url = urllib.parse.urlparse(args.url)
+    payloads = load_payloads(args.batch_size)
+
+    latencies = []
+    failures = []
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(
+            target=worker, args=(url, payloads, deadline, latencies, failures)
+        )
+        for _ in range(args.concurrency)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        raise SystemExit("No successful requests ({} failures)".format(len(failures)))
+
+    latencies = numpy.array(latencies) * 1000
+
+    print("requests:    {} ok, {} failed".format(len(latencies), len(failures)))
+    print("latency p50: {:.2f} ms".format(numpy.percentile(latencies, 50)))
+    print("latency p99: {:.2f} ms".format(numpy.percentile(latencies, 99)))
+    print("throughput:  {:.0f} requests/sec".format(len(latencies) / elapsed))
+    print(
+        "             {:.0f} records/sec".format(
+            len(latencies) * args.batch_size / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
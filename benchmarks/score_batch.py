@@ -0,0 +1,98 @@
+"""
+Records/sec of german_credit.score_batch() against calling score() in a loop,
+and of the compiled NumPy kernel against the sklearn pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.score_batch [--repeat N]
+"""
+
+import argparse
+import os
+import time
+
+import pandas
+
+from app import german_credit
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "app", "data")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="times the reference set is replicated"
+    )
+    args = parser.parse_args()
+
+    german_credit.init(os.path.join(DATA_DIR, "logreg_classifier.pickle"))
+
+    input_data = pandas.concat(
+        [
+            pandas.read_json(os.path.join(DATA_DIR, name), lines=True, orient="records")
+            for name in ("training_data.json", "testing_data.json")
+        ],
+        ignore_index=True,
+    )
+    records = input_data.to_dict(orient="records")
+
+    # Single-record path, one model call per record
+    start = time.perf_counter()
+    loop_probabilities = [
+        german_credit.score(record)["probability_of_default"] for record in records
+    ]
+    loop_seconds = time.perf_counter() - start
+
+    # Batch path, one model call for the whole set
+    batch = pandas.concat([input_data] * args.repeat, ignore_index=True)
+    start = time.perf_counter()
+    probabilities, _ = german_credit.score_batch(batch)
+    batch_seconds = time.perf_counter() - start
+
+    assert (probabilities[: len(records)] == loop_probabilities).all()
+
+    print(
+        "score() loop:  {:>10.0f} records/sec ({} records)".format(
+            len(records) / loop_seconds, len(records)
+        )
+    )
+    print(
+        "score_batch(): {:>10.0f} records/sec ({} records)".format(
+            len(batch) / batch_seconds, len(batch)
+        )
+    )
+    print(
+        "speed-up:      {:>10.1f}x".format(
+            (len(batch) / batch_seconds) / (len(records) / loop_seconds)
+        )
+    )
+
+    # Compiled NumPy kernel against the sklearn pipeline, on the same batch
+    if german_credit.active_model.kernel is not None:
+        features = batch[german_credit.predictive_features].astype(
+            {"number_people_liable": "category"}
+        )
+        model = german_credit.load_model()  # unpickled on first use
+
+        start = time.perf_counter()
+        model.predict_proba(features)
+        sklearn_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        german_credit.fast_predict_proba(batch)
+        kernel_seconds = time.perf_counter() - start
+
+        print(
+            "sklearn predict_proba: {:>10.0f} records/sec".format(
+                len(batch) / sklearn_seconds
+            )
+        )
+        print(
+            "fast_predict_proba:    {:>10.0f} records/sec".format(
+                len(batch) / kernel_seconds
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
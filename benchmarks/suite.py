@@ -0,0 +1,427 @@
+"""
+Benchmark suite: model load, scoring, top-k matching, CSV export and Dash callbacks.
+
+Runs offline against the bundled app/data files and writes the results as JSON,
+so that runs can be compared. Run from the repository root:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --output new.json --compare results.json
+
+Matching is measured on synthetic reference sets (--sizes), with values drawn
+from the vocabularies of the bundled records.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+import pandas
+import sklearn
+
+DATA_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, "app", "data")
+)
+
+# The app reads its files from DATA_DIR; keep its side effects out of the repo
+os.environ.setdefault("DATA_DIR", DATA_DIR)
+os.environ.setdefault(
+    "FEEDBACK_PATH", os.path.join(tempfile.gettempdir(), "benchmark_feedback.jsonl")
+)
+os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+
+from app import german_credit  # noqa: E402
+from app.data_loader import read_json_lines  # noqa: E402
+from app.events import event_log  # noqa: E402
+from app.export import iter_scored_csv  # noqa: E402
+from app.matching import MatchIndex  # noqa: E402
+from app.reference import build_reference_data, precompute_scores  # noqa: E402
+from app.similarity import SimilarityIndex  # noqa: E402
+
+MODEL_PATH = os.path.join(DATA_DIR, "logreg_classifier.pickle")
+DATA_FILES = ("training_data.json", "testing_data.json")
+
+# Status and error events of the app go to stderr, keeping stdout valid JSON
+event_log.handler = logging.StreamHandler(sys.stderr)
+
+
+def measure(function, repeat: int = 5) -> dict:
+    """
+    A function to time repeated calls of a function.
+
+    Args:
+        function: callable without arguments.
+        repeat (int): number of timed calls.
+
+    Returns:
+        (dict): median, min and max duration of a call, in seconds.
+    """
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return {
+        "median_seconds": statistics.median(durations),
+        "min_seconds": min(durations),
+        "max_seconds": max(durations),
+    }
+
+
+def load_reference_data():
+    return build_reference_data(
+        {
+            name: pandas.read_json(
+                os.path.join(DATA_DIR, name), lines=True, orient="records"
+            )
+            for name in DATA_FILES
+        }
+    )
+
+
+def bench_load(repeat: int) -> dict:
+    # Model artifact, and the reference files through the cold and warm cache
+    results = {"init": measure(lambda: german_credit.init(MODEL_PATH), repeat)}
+
+    path = os.path.join(DATA_DIR, DATA_FILES[0])
+    results["read_json"] = measure(
+        lambda: pandas.read_json(path, lines=True, orient="records"), repeat
+    )
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+
+        def cold():
+            shutil.rmtree(cache_dir)
+            read_json_lines(path, cache_dir=cache_dir)
+
+        results["read_json_lines_cold"] = measure(cold, repeat)
+        results["read_json_lines_warm"] = measure(
+            lambda: read_json_lines(path, cache_dir=cache_dir), repeat
+        )
+
+    return results
+
+
+def bench_scoring(reference_data, repeat: int) -> dict:
+    records = reference_data.data.to_dict(orient="records")
+
+    def single():
+        german_credit.score_cache.clear()
+        for record in records:
+            german_credit.score(record)
+
+    def cached():
+        for record in records:
+            german_credit.score(record)
+
+    results = {
+        "score": measure(single, repeat),
+        "score_cached": measure(cached, repeat),
+        "score_batch": measure(
+            lambda: german_credit.score_batch(reference_data.data), repeat
+        ),
+    }
+
+    for result in results.values():
+        result["records_per_second"] = len(records) / result["median_seconds"]
+
+    results["records"] = len(records)
+    return results
+
+
+def synthetic_codes(reference_data, n_records: int, seed: int = 0) -> numpy.ndarray:
+    """
+    A function to generate an encoded reference set of n_records rows, with codes
+    drawn uniformly from the vocabulary of each column of the bundled records
+    (the id column stays unique).
+
+    Returns:
+        (numpy.ndarray): int32 codes of shape (n_records, columns).
+    """
+
+    rng = numpy.random.default_rng(seed)
+    codes = numpy.empty((n_records, reference_data.codes.shape[1]), dtype=numpy.int32)
+
+    for j, (column, vocabulary) in enumerate(reference_data.vocabularies.items()):
+        if column == "id":
+            codes[:, j] = numpy.arange(n_records)
+        else:
+            codes[:, j] = rng.integers(0, len(vocabulary), n_records)
+
+    return codes
+
+
+def bench_matching(reference_data, sizes: list, queries: int) -> dict:
+    results = {}
+
+    for n_records in sizes:
+        codes = synthetic_codes(reference_data, n_records)
+        positions = numpy.random.default_rng(1).integers(0, n_records, queries)
+
+        for mode in ("dense", "inverted"):
+            start = time.perf_counter()
+            index = MatchIndex(codes, mode=mode)
+            build_seconds = time.perf_counter() - start
+
+            timing = measure(
+                lambda: [
+                    index.top_k(codes[position], k=5, exclude=position)
+                    for position in positions
+                ],
+                repeat=3,
+            )
+
+            results["{}_{}".format(mode, n_records)] = {
+                "records": n_records,
+                "build_seconds": build_seconds,
+                "median_query_seconds": timing["median_seconds"] / queries,
+                "queries_per_second": queries / timing["median_seconds"],
+            }
+
+        # Similarity search over the predictive features, in chunks
+        data = pandas.DataFrame(
+            {
+                name: reference_data.vocabularies[name].take(codes[:, j])
+                for j, name in enumerate(reference_data.vocabularies)
+                if name in german_credit.predictive_features
+            }
+        )
+        for metric in ("gower", "hamming"):
+            start = time.perf_counter()
+            index = SimilarityIndex(data, german_credit.predictive_features, metric)
+            build_seconds = time.perf_counter() - start
+
+            timing = measure(
+                lambda: [
+                    index.top_k(index.query(position), k=5, exclude=position)
+                    for position in positions
+                ],
+                repeat=3,
+            )
+
+            results["{}_{}".format(metric, n_records)] = {
+                "records": n_records,
+                "build_seconds": build_seconds,
+                "median_query_seconds": timing["median_seconds"] / queries,
+                "queries_per_second": queries / timing["median_seconds"],
+            }
+
+    return results
+
+
+def bench_export(reference_data, repeat: int) -> dict:
+    results = {}
+
+    for name, data in (
+        ("scored", reference_data),
+        ("precomputed", precompute_scores(reference_data)),
+    ):
+        size = len("".join(iter_scored_csv(data)).encode())
+        result = measure(lambda: "".join(iter_scored_csv(data)), repeat)
+        result["bytes"] = size
+        result["megabytes_per_second"] = size / result["median_seconds"] / 1e6
+        results[name] = result
+
+    return results
+
+
+def callback_payload(outputs: list, inputs: list, state: list = ()) -> dict:
+    # Request body of /_dash-update-component, as sent by the Dash renderer
+    output = (
+        "{}.{}".format(*outputs[0])
+        if len(outputs) == 1
+        else ".." + "...".join("{}.{}".format(*output) for output in outputs) + ".."
+    )
+
+    return {
+        "output": output,
+        "outputs": (
+            {"id": outputs[0][0], "property": outputs[0][1]}
+            if len(outputs) == 1
+            else [{"id": id, "property": name} for id, name in outputs]
+        ),
+        "inputs": [
+            {"id": id, "property": name, "value": value} for id, name, value in inputs
+        ],
+        "changedPropIds": ["{}.{}".format(*inputs[0][:2])],
+        "state": [
+            {"id": id, "property": name, "value": value} for id, name, value in state
+        ],
+    }
+
+
+def bench_callbacks(repeat: int) -> dict:
+    # End-to-end: HTTP request through Flask and Dash, callback, JSON response
+    from app.app import create_app
+
+    client = create_app().server.test_client()
+
+    payloads = {
+        "update_id": callback_payload(
+            [("input_record_visual", "data")], [("id", "value", 5)]
+        ),
+        "update_table": callback_payload(
+            [
+                ("matches_table", "data"),
+                ("messages", "children"),
+                ("explanation", "children"),
+                ("scored_record", "data"),
+            ],
+            [("scoring_button", "n_clicks", 1)],
+            [
+                ("id", "value", 5),
+                ("matches_k", "value", 5),
+                ("matches_filters", "value", []),
+            ],
+        ),
+        "update_whatif": callback_payload(
+            [("whatif_graph", "figure")],
+            [
+                ("id", "value", 5),
+                ("whatif_features", "value", ["credit_amount", "duration_months"]),
+            ],
+        ),
+        "update_download_data_link": callback_payload(
+            [("download_data_link", "href"), ("download_data_link", "download")],
+            [
+                ("id", "value", 5),
+                ("matches_k", "value", 5),
+                ("matches_filters", "value", []),
+            ],
+        ),
+    }
+
+    results = {}
+
+    for name, payload in payloads.items():
+
+        def call():
+            response = client.post("/_dash-update-component", json=payload)
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+        call()
+        result = measure(lambda: [call() for _ in range(20)], repeat)
+        results[name] = {
+            "median_seconds": result["median_seconds"] / 20,
+            "calls_per_second": 20 / result["median_seconds"],
+        }
+
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict) -> None:
+    # Ratio of each metric to the baseline run (times: lower is better)
+    current, previous = flatten(results), flatten(baseline["results"])
+
+    print("{:<58} {:>12} {:>12} {:>8}".format("metric", "baseline", "current", "ratio"))
+    for key in sorted(current.keys() & previous.keys()):
+        if previous[key]:
+            print(
+                "{:<58} {:>12.4g} {:>12.4g} {:>7.2f}x".format(
+                    key, previous[key], current[key], current[key] / previous[key]
+                )
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="JSON file for the results (stdout if unset)")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--sizes",
+        default="1000,100000,1000000",
+        help="comma-separated sizes of the synthetic matching sets",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=20, help="top-k queries per matching set"
+    )
+    parser.add_argument(
+        "--only",
+        default="load,scoring,matching,export,callbacks",
+        help="comma-separated benchmarks to run",
+    )
+    args = parser.parse_args()
+
+    only = set(args.only.split(","))
+    german_credit.init(MODEL_PATH)
+    reference_data = load_reference_data()
+
+    benchmarks = {
+        "load": lambda: bench_load(args.repeat),
+        "scoring": lambda: bench_scoring(reference_data, args.repeat),
+        "matching": lambda: bench_matching(
+            reference_data, [int(size) for size in args.sizes.split(",")], args.queries
+        ),
+        "export": lambda: bench_export(reference_data, args.repeat),
+        "callbacks": lambda: bench_callbacks(args.repeat),
+    }
+
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if name in only:
+            print("Running {} benchmarks...".format(name), file=sys.stderr)
+            # Anything else the app prints goes there too
+            with contextlib.redirect_stdout(sys.stderr):
+                results[name] = benchmark()
+
+    report = json.dumps({"metadata": metadata(), "results": results}, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
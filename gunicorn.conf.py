@@ -0,0 +1,31 @@
+"""
+Production gunicorn settings for the Dash app.
+
+Usage:
+    gunicorn -c gunicorn.conf.py "app.wsgi:create_server()"
+
+The model and reference data are loaded once in the master (preload_app) and
+shared copy-on-write by the forked workers. Each worker serves requests with a
+pool of threads. Overrides: GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_THREADS.
+"""
+
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:80")
+
+# Load the app (model + reference data) in the master, before forking workers
+preload_app = True
+
+# Scoring is CPU-bound: one process per core, plus threads to overlap I/O
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+
+def when_ready(server):
+    # Move everything allocated so far (the preloaded app) out of the garbage
+    # collector's generations. Collections in the workers would otherwise touch
+    # the headers of these objects and un-share their pages.
+    gc.freeze()
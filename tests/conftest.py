@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+from app.data_loader import read_json_lines
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "app", "data")
+
+MODEL_PATH = os.path.join(DATA_DIR, "logreg_classifier.pickle")
+
+
+@pytest.fixture(scope="session")
+def reference_records(tmp_path_factory):
+    # Training then testing records, cached outside the source tree
+    return read_json_lines(
+        [
+            os.path.join(DATA_DIR, "training_data.json"),
+            os.path.join(DATA_DIR, "testing_data.json"),
+        ],
+        cache_dir=str(tmp_path_factory.mktemp("data_cache")),
+    )
@@ -0,0 +1,101 @@
+import threading
+
+import numpy
+import pandas
+import pytest
+
+from app.drift import DriftMonitor
+
+
+@pytest.fixture
+def baseline():
+    return pandas.DataFrame(
+        {
+            "amount": [0.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 100.0],
+            "purpose": ["car", "car", "tv", "tv", "tv", "car", "tv", "car", "tv", "tv"],
+        }
+    )
+
+
+@pytest.fixture
+def monitor(baseline):
+    return DriftMonitor(baseline, ["amount", "purpose"], bins=4)
+
+
+def feature_counts(monitor, name):
+    report = monitor.report()["features"][name]
+    return report["bins"], numpy.array(report["observed"])
+
+
+def test_baseline_counts(monitor):
+    # amount: 4 bins of width 25 over [0, 100]; purpose: car, tv and unseen
+    assert monitor.baseline_counts.tolist() == [3, 2, 3, 2, 4, 6, 0]
+    assert monitor.labels["purpose"] == ["car", "tv", "(unseen)"]
+
+
+def test_observe_counts_each_record_once_per_feature(monitor):
+    records = [
+        {"amount": -5.0, "purpose": "car"},  # below the baseline range
+        {"amount": 25.0, "purpose": "tv"},  # on an inner edge: the upper bin
+        {"amount": 99.0, "purpose": "radio"},  # unseen category
+        {"amount": 500.0, "purpose": "tv"},  # above the baseline range
+    ]
+    for record in records:
+        monitor.observe(record)
+
+    assert monitor.observed_counts().tolist() == [1, 1, 0, 2, 1, 2, 1]
+    assert monitor.report()["records"] == 4
+
+
+def test_observe_batch_matches_observe(baseline):
+    rng = numpy.random.default_rng(0)
+    batch = pandas.DataFrame(
+        {
+            "amount": rng.uniform(-20, 120, 1000),
+            "purpose": rng.choice(["car", "tv", "radio"], 1000),
+        }
+    )
+
+    one_by_one = DriftMonitor(baseline, ["amount", "purpose"], bins=4)
+    for record in batch.to_dict(orient="records"):
+        one_by_one.observe(record)
+
+    batched = DriftMonitor(baseline, ["amount", "purpose"], bins=4)
+    batched.observe_batch(batch)
+
+    assert batched.observed_counts().tolist() == one_by_one.observed_counts().tolist()
+    assert batched.report()["records"] == 1000
+
+
+def test_counts_of_all_threads_are_kept(monitor):
+    record = {"amount": 10.0, "purpose": "car"}
+
+    def observe():
+        for _ in range(100):
+            monitor.observe(record)
+
+    for _ in range(10):
+        threads = [threading.Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert monitor.report()["records"] == 4000
+    _, shares = feature_counts(monitor, "purpose")
+    assert shares.tolist() == [1.0, 0.0, 0.0]
+
+    # Finished threads are folded: only live threads keep their own counters
+    assert len(monitor._accumulators) == 0
+
+
+def test_report_levels(monitor):
+    assert monitor.report()["features"]["amount"]["psi"] is None
+
+    for _ in range(10):
+        monitor.observe({"amount": 10.0, "purpose": "car"})
+
+    report = monitor.report()["features"]
+    assert report["amount"]["level"] == "significant"
+    assert report["amount"]["psi"] > 0.25
+    assert report["amount"]["kl_divergence"] > 0
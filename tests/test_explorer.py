@@ -0,0 +1,84 @@
+import pandas
+import pytest
+
+from app.explorer import PopulationExplorer, parse_filter_query
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("{Amount} = 1000", [("Amount", "eq", "1000", True)]),
+        ("{Amount} eq 1000", [("Amount", "eq", "1000", True)]),
+        ("{Amount} != 1000", [("Amount", "ne", "1000", True)]),
+        ("{Amount} < 1000", [("Amount", "lt", "1000", True)]),
+        ("{Amount} le 1000", [("Amount", "le", "1000", True)]),
+        ("{Amount} > 1000", [("Amount", "gt", "1000", True)]),
+        ("{Amount} >= 1000", [("Amount", "ge", "1000", True)]),
+        ("{Gender} contains fem", [("Gender", "contains", "fem", True)]),
+        ("{Gender} icontains fem", [("Gender", "contains", "fem", False)]),
+        ("{Gender} scontains fem", [("Gender", "contains", "fem", True)]),
+        ('{Gender} ieq "Female"', [("Gender", "eq", "Female", False)]),
+        ("{Gender} s= 'male'", [("Gender", "eq", "male", True)]),
+        ("{Date} datestartswith 2023", [("Date", "datestartswith", "2023", True)]),
+        ("{Gender} is blank", [("Gender", "blank", None, True)]),
+        ("{Gender} is nil", [("Gender", "blank", None, True)]),
+        (
+            "{Amount} > 1000 && {Gender} is blank",
+            [("Amount", "gt", "1000", True), ("Gender", "blank", None, True)],
+        ),
+        ("", []),
+        (None, []),
+    ],
+)
+def test_parse_filter_query(query, expected):
+    assert parse_filter_query(query) == expected
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "{Amount} between 1 2",
+        "{Gender} is prime",
+        "{Amount} > 1000 && {Gender} like fem",
+        "Amount > 1000",
+    ],
+)
+def test_parse_filter_query_rejects_unsupported_filters(query):
+    with pytest.raises(ValueError):
+        parse_filter_query(query)
+
+
+@pytest.fixture
+def explorer():
+    return PopulationExplorer(
+        pandas.DataFrame(
+            {
+                "Amount": [500, 1500, 2500, 1000],
+                "Gender": ["female", "male", None, "Female"],
+            }
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "query, amounts",
+    [
+        ("{Amount} > 1000", [1500, 2500]),
+        ("{Amount} <= 1000", [500, 1000]),
+        ("{Gender} is blank", [2500]),
+        ("{Gender} eq female", [500]),
+        ("{Gender} ieq female", [500, 1000]),
+        ("{Gender} icontains MAL", [500, 1500, 1000]),
+        ("{Amount} >= 1000 && {Gender} contains male", [1500, 1000]),
+    ],
+)
+def test_page_filters_rows(explorer, query, amounts):
+    rows, _, count = explorer.page(0, 10, [], query)
+
+    assert [row["Amount"] for row in rows] == amounts
+    assert count == len(amounts)
+
+
+def test_page_raises_on_invalid_filter(explorer):
+    with pytest.raises(ValueError):
+        explorer.page(0, 10, [], "{Amount} between 1 2")
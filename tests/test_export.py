@@ -0,0 +1,48 @@
+import pytest
+
+from app.export import parse_ids, parse_json_ids
+
+
+@pytest.mark.parametrize(
+    "values, expected",
+    [
+        (["1", "2"], [1, 2]),
+        (["1,2", "3"], [1, 2, 3]),
+        (["1, 2,"], [1, 2]),
+        ([], []),
+    ],
+)
+def test_parse_ids(values, expected):
+    assert parse_ids(values) == expected
+
+
+def test_parse_ids_rejects_non_integers():
+    with pytest.raises(ValueError):
+        parse_ids(["1,a"])
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [({"ids": [1, 2]}, [1, 2]), ({"ids": []}, []), ({}, [])],
+)
+def test_parse_json_ids(body, expected):
+    assert parse_json_ids(body) == expected
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"ids": "12"},
+        {"ids": 12},
+        {"ids": [1, "2"]},
+        {"ids": [1.5]},
+        {"ids": [True]},
+        {"ids": None},
+        [1, 2],
+        "12",
+        None,
+    ],
+)
+def test_parse_json_ids_rejects_invalid_bodies(body):
+    with pytest.raises(ValueError):
+        parse_json_ids(body)
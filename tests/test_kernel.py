@@ -0,0 +1,93 @@
+import pickle
+
+import numpy
+import pytest
+
+from app.german_credit import ScoringModel, predictive_features
+from app.kernel import compile_model, load_kernel, save_kernel
+
+from .conftest import MODEL_PATH
+
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope="module")
+def sklearn_model():
+    with open(MODEL_PATH, "rb") as artifact:
+        return pickle.load(artifact)
+
+
+@pytest.fixture(scope="module")
+def expected(sklearn_model, reference_records):
+    features = reference_records[predictive_features].astype(
+        {"number_people_liable": "category"}
+    )
+    return sklearn_model.predict_proba(features)
+
+
+def test_compiled_kernel_matches_sklearn(sklearn_model, reference_records, expected):
+    kernel = compile_model(sklearn_model)
+
+    assert kernel is not None
+    numpy.testing.assert_allclose(
+        kernel.predict_proba(reference_records), expected, rtol=0, atol=TOLERANCE
+    )
+
+
+def test_single_record_path_matches_batch(sklearn_model, reference_records, expected):
+    kernel = compile_model(sklearn_model)
+    records = reference_records.head(50).to_dict(orient="records")
+
+    probabilities = [kernel.predict_proba_record(record) for record in records]
+
+    numpy.testing.assert_allclose(
+        probabilities, expected[:50, 1], rtol=0, atol=TOLERANCE
+    )
+
+
+def test_saved_kernel_matches_sklearn(
+    sklearn_model, reference_records, expected, tmp_path
+):
+    path = str(tmp_path / "kernel.json")
+    save_kernel(compile_model(sklearn_model), path, "digest", validated=True)
+
+    kernel, validated = load_kernel(path, "digest")
+
+    assert validated
+    numpy.testing.assert_allclose(
+        kernel.predict_proba(reference_records), expected, rtol=0, atol=TOLERANCE
+    )
+
+
+def test_saved_kernel_is_ignored_for_another_artifact(sklearn_model, tmp_path):
+    path = str(tmp_path / "kernel.json")
+    save_kernel(compile_model(sklearn_model), path, "digest")
+
+    assert load_kernel(path, "other digest") is None
+    assert load_kernel(str(tmp_path / "missing.json"), "digest") is None
+
+
+def test_scoring_model_reloads_saved_kernel(reference_records, expected, tmp_path):
+    compiled = ScoringModel(MODEL_PATH, cache_dir=str(tmp_path))
+    reloaded = ScoringModel(MODEL_PATH, cache_dir=str(tmp_path))
+
+    # Loaded from the saved kernel: the artifact is not unpickled
+    assert reloaded._model is None
+    for model in (compiled, reloaded):
+        numpy.testing.assert_allclose(
+            model.predict_proba(reference_records), expected, rtol=0, atol=TOLERANCE
+        )
+
+
+def test_contributions_add_up_to_log_odds(sklearn_model, reference_records):
+    kernel = compile_model(sklearn_model)
+
+    contributions = kernel.contributions(reference_records)
+    log_odds = kernel.scale * kernel.decision_function(reference_records)
+
+    numpy.testing.assert_allclose(
+        contributions.sum(axis=1) + kernel.scale * kernel.intercept,
+        log_odds,
+        rtol=0,
+        atol=TOLERANCE,
+    )
@@ -0,0 +1,91 @@
+import numpy
+import pytest
+
+from app.matching import MatchIndex
+from app.similarity import SimilarityIndex
+
+
+def brute_force(codes, query, k, exclude=None, candidates=None):
+    # Rank every record by match count, then position; missing values never match
+    counts = (codes == numpy.where(query < 0, -2, query)).sum(axis=1)
+    positions = [
+        position
+        for position in sorted(range(len(codes)), key=lambda i: (-counts[i], i))
+        if position != exclude and (candidates is None or candidates[position])
+    ][:k]
+    return positions, counts[positions].tolist()
+
+
+@pytest.fixture(scope="module")
+def codes():
+    # Few codes per column, so that many records tie; -1 codes are missing values
+    rng = numpy.random.default_rng(0)
+    codes = rng.integers(0, 4, size=(500, 6), dtype=numpy.int32)
+    codes[rng.random(codes.shape) < 0.05] = -1
+    return codes
+
+
+@pytest.mark.parametrize("mode", ["dense", "inverted"])
+@pytest.mark.parametrize("k", [1, 5, 50, 1000])
+def test_top_k_matches_brute_force(codes, mode, k):
+    index = MatchIndex(codes, mode=mode)
+
+    for position in range(0, len(codes), 50):
+        query = codes[position]
+        positions, counts = index.top_k(query, k=k, exclude=position)
+
+        assert (positions.tolist(), counts.tolist()) == brute_force(
+            codes, query, k, exclude=position
+        )
+
+
+@pytest.mark.parametrize("mode", ["dense", "inverted"])
+def test_top_k_with_candidates_matches_brute_force(codes, mode):
+    index = MatchIndex(codes, mode=mode)
+    candidates = numpy.zeros(len(codes), dtype=bool)
+    candidates[::7] = True
+
+    for position in range(0, len(codes), 50):
+        query = codes[position]
+        positions, counts = index.top_k(
+            query, k=20, exclude=position, candidates=candidates
+        )
+
+        assert (positions.tolist(), counts.tolist()) == brute_force(
+            codes, query, 20, exclude=position, candidates=candidates
+        )
+
+
+@pytest.mark.parametrize("mode", ["dense", "inverted"])
+def test_unseen_and_missing_query_values_never_match(codes, mode):
+    index = MatchIndex(codes, mode=mode)
+    query = numpy.array([-1, 99, -1, 99, -1, 99], dtype=numpy.int32)
+
+    assert not index.match_counts(query).any()
+
+
+@pytest.mark.parametrize("mode", ["dense", "inverted"])
+def test_fewer_candidates_than_k(codes, mode):
+    index = MatchIndex(codes, mode=mode)
+    candidates = numpy.zeros(len(codes), dtype=bool)
+    candidates[[3, 10, 42]] = True
+
+    positions, _ = index.top_k(codes[10], k=5, exclude=10, candidates=candidates)
+
+    assert sorted(positions.tolist()) == [3, 42]
+
+
+def test_similarity_blocks_match_full_scan(reference_records):
+    features = ["credit_amount", "duration_months", "purpose", "housing", "job"]
+    chunked = SimilarityIndex(reference_records, features, chunk_size=64)
+    full = SimilarityIndex(reference_records, features, chunk_size=10**6)
+
+    for position in range(0, len(reference_records), 97):
+        query = full.query(position)
+        distances = full.distances(query)
+        distances[position] = numpy.inf
+        expected = numpy.lexsort((numpy.arange(len(distances)), distances))[:10]
+
+        for index in (chunked, full):
+            positions, _ = index.top_k(query, k=10, exclude=position)
+            assert positions.tolist() == expected.tolist()